@@ -1,6 +1,5 @@
 import os
 
-import uvicorn
 from fastapi import FastAPI
 from google.adk.cli.fast_api import get_fast_api_app
 
@@ -8,6 +7,11 @@ from google.adk.cli.fast_api import get_fast_api_app
 AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
 app_args = {"agents_dir": AGENT_DIR, "web": True, "allow_origins": ["*"]}
 
+# Sessions are in-memory per worker by default; point this at a shared store
+# (e.g. a database URL) when running more than one worker
+if os.environ.get("SESSION_SERVICE_URI"):
+    app_args["session_service_uri"] = os.environ["SESSION_SERVICE_URI"]
+
 # Create FastAPI app with ADK integration
 app: FastAPI = get_fast_api_app(**app_args)
 
@@ -17,11 +21,11 @@ app.description = "Multi-Agent System for CrowdGuard"
 app.version = "1.0.0"
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "production-adk-agent"}
 
 @app.get("/")
-def root():
+async def root():
     return {
         "service": "Production ADK for CrowdGuard",
         "description": "Multi-Agent System for CrowdGuard",
@@ -30,4 +34,18 @@ def root():
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080, log_level="info")
\ No newline at end of file
+    # Run under gunicorn with uvicorn workers so requests spread across processes.
+    # In-memory sessions live in one worker, so scale out only with a shared session store
+    shared_sessions = bool(os.environ.get("SESSION_SERVICE_URI"))
+    workers = int(os.environ.get("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1 if shared_sessions else 1))
+    if workers > 1 and not shared_sessions:
+        raise SystemExit("WEB_CONCURRENCY > 1 needs SESSION_SERVICE_URI, or sessions are lost between workers")
+    os.chdir(AGENT_DIR)
+    os.execvp("gunicorn", [
+        "gunicorn",
+        "-k", "uvicorn.workers.UvicornWorker",
+        "-w", str(workers),
+        "-b", "0.0.0.0:8080",
+        "--log-level", "info",
+        "main:app",
+    ])
\ No newline at end of file
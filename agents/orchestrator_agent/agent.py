@@ -1,49 +1,115 @@
 import os
-import json
+import re
+import textwrap
+import atexit
+import copy
+import orjson
 import smtplib
 import ssl
+import threading
+import requests
+from cachetools import TTLCache
 from email.message import EmailMessage
 from google.adk.agents import Agent, ParallelAgent, SequentialAgent
+from google.genai import types
 from newsapi import NewsApiClient
 from google.cloud import storage
 
 # --- Existing Helper Functions ---
 
+# Shared GCS client and parsed-JSON cache keyed by "bucket/blob" -> (generation, data)
+_gcs_client = None
+_GCS_CACHE: dict[str, tuple[int, dict]] = {}
+
+def _get_gcs_client() -> storage.Client:
+    """Returns the process-wide GCS client, creating it on first use."""
+    global _gcs_client
+    if _gcs_client is None:
+        _gcs_client = storage.Client()
+    return _gcs_client
+
 def read_gcs_file(gcs_path: str) -> dict:
     """Reads a JSON file from Google Cloud Storage."""
     try:
-        client = storage.Client()
+        client = _get_gcs_client()
         # Handle cases where gs:// might be missing or present
         clean_path = gcs_path.replace("gs://", "")
         bucket_name, blob_name = clean_path.split("/", 1)
         
         bucket = client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
-        file_content = blob.download_as_string()
-        return json.loads(file_content)
+
+        # Metadata-only request; skip the download if the object hasn't changed
+        blob.reload()
+        cached = _GCS_CACHE.get(clean_path)
+        if cached is not None and cached[0] == blob.generation:
+            return copy.deepcopy(cached[1])
+
+        data = orjson.loads(blob.download_as_bytes())
+        _GCS_CACHE[clean_path] = (blob.generation, data)
+        return copy.deepcopy(data)
     except Exception as e:
         return {"error": f"Failed to read GCS file: {str(e)}"}
 
 class RetryingAgent(Agent):
-    """An Agent wrapper that adds JSON parsing and retry logic."""
+    """An Agent whose model calls retry rate limits and server errors with exponential backoff."""
     max_retries: int = 2
 
     def __init__(self, *args, max_retries: int = 2, **kwargs):
+        # Retries happen inside the Gemini client, on every model call ADK makes for this agent
+        kwargs.setdefault("generate_content_config", types.GenerateContentConfig(
+            http_options=types.HttpOptions(retry_options=types.HttpRetryOptions(
+                attempts=max_retries + 1,
+                initial_delay=0.25,
+                exp_base=2,
+                jitter=0.1,
+                http_status_codes=[408, 429, 500, 502, 503, 504],
+            ))
+        ))
         super().__init__(*args, **kwargs)
         self.max_retries = max_retries
 
-    def invoke(self, *args, **kwargs) -> str:
-        for attempt in range(self.max_retries + 1):
+# --- New Email Tool ---
+
+# One logged-in SMTP connection shared across alerts (TLS + LOGIN dominate send latency)
+_SMTP_LOCK = threading.Lock()
+_smtp_conn = None
+
+def _get_smtp_connection(sender_email: str, email_password: str) -> smtplib.SMTP_SSL:
+    """Returns the cached SMTP connection, reconnecting if it has dropped. Caller holds _SMTP_LOCK."""
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp_conn = None
+
+    context = ssl.create_default_context()
+    conn = smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context)
+    conn.login(sender_email, email_password)
+    _smtp_conn = conn
+    return conn
+
+@atexit.register
+def _close_smtp_connection():
+    with _SMTP_LOCK:
+        if _smtp_conn is not None:
             try:
-                response = super().invoke(*args, **kwargs)
-                json.loads(response)
-                return response
-            except json.JSONDecodeError as e:
-                print(f"Warning: Agent '{self.name}' invalid JSON. Retrying...")
-                if attempt == self.max_retries:
-                    return json.dumps({"error": "Invalid JSON Output", "details": str(e)})
+                _smtp_conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
 
-# --- New Email Tool ---
+def _build_email_message(subject: str, html_content: str, sender_email: str, receiver_email: str) -> EmailMessage:
+    """Builds an HTML email with a plain-text fallback."""
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = sender_email
+    msg["To"] = receiver_email
+    msg.set_content("Please enable HTML to view this report.") # Fallback for non-HTML clients
+    msg.add_alternative(html_content, subtype="html")
+    return msg
 
 def send_email_alert(subject: str, html_content: str) -> str:
     """
@@ -52,40 +118,92 @@ def send_email_alert(subject: str, html_content: str) -> str:
         subject: The subject line of the email.
         html_content: The HTML body of the email.
     """
+    return send_email_alerts([subject], [html_content])[0]
+
+def send_email_alerts(subjects: list[str], html_contents: list[str]) -> list[str]:
+    """
+    Sends several HTML emails over a single SMTP session.
+    Args:
+        subjects: The subject line of each email.
+        html_contents: The HTML body of each email, in the same order as subjects.
+    Returns:
+        One status string per email, in order.
+    """
+    if len(subjects) != len(html_contents):
+        return [f"Error: got {len(subjects)} subjects but {len(html_contents)} HTML bodies."]
+        
     sender_email = os.environ.get("EMAIL_SENDER")
     email_password = os.environ.get("EMAIL_PASSWORD")
     receiver_email = os.environ.get("EMAIL_RECIPIENT")
 
     if not all([sender_email, email_password, receiver_email]):
-        return "Error: Missing EMAIL_SENDER, EMAIL_PASSWORD, or EMAIL_RECIPIENT environment variables."
+        return ["Error: Missing EMAIL_SENDER, EMAIL_PASSWORD, or EMAIL_RECIPIENT environment variables."] * len(subjects)
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = sender_email
-    msg["To"] = receiver_email
-    msg.set_content("Please enable HTML to view this report.") # Fallback for non-HTML clients
-    msg.add_alternative(html_content, subtype="html")
-
-    try:
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-            server.login(sender_email, email_password)
-            server.send_message(msg)
-        return "Email sent successfully."
-    except Exception as e:
-        return f"Failed to send email: {str(e)}"
+    statuses = []
+    with _SMTP_LOCK:
+        for subject, html_content in zip(subjects, html_contents):
+            msg = _build_email_message(subject, html_content, sender_email, receiver_email)
+            try:
+                server = _get_smtp_connection(sender_email, email_password)
+                server.send_message(msg)
+                statuses.append("Email sent successfully.")
+            except Exception as e:
+                statuses.append(f"Failed to send email: {str(e)}")
+    return statuses
 
 # --- Agents Definitions ---
 
+def _normalize_instruction(text: str) -> str:
+    """Dedents and trims an instruction so the prompt prefix is stable and compact across calls."""
+    first_line, _, rest = text.partition("\n")
+    text = first_line.strip() + "\n" + textwrap.dedent(rest)
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
 # 1. News Gatherer
 target_location = os.environ.get("TARGET_LOCATION", "Unknown Location")
+_news_client = None
+
+def _get_news_client() -> NewsApiClient:
+    """Returns the process-wide NewsAPI client backed by a keep-alive HTTP session."""
+    global _news_client
+    if _news_client is None:
+        _news_client = NewsApiClient(api_key=os.environ.get("NEWS_API_KEY"), session=requests.Session())
+    return _news_client
+
+# Recent NewsAPI results keyed by (query, language, page_size); news moves on the order of minutes
+_NEWS_CACHE = TTLCache(maxsize=256, ttl=120)
+_NEWS_CACHE_LOCK = threading.Lock()
+_news_cache_hits = 0
+_news_cache_misses = 0
+
 def search_news(query: str, language: str = "en", page_size: int = 10):
+    global _news_cache_hits, _news_cache_misses
+    key = (query, language, page_size)
+    with _NEWS_CACHE_LOCK:
+        cached = _NEWS_CACHE.get(key)
+        if cached is not None:
+            _news_cache_hits += 1
+        else:
+            _news_cache_misses += 1
+        hits, total = _news_cache_hits, _news_cache_hits + _news_cache_misses
+    if cached is not None:
+        print(f"News cache hit for '{query}' ({hits}/{total} hits)")
+        return copy.deepcopy(cached)
+
     try:
-        newsapi = NewsApiClient(api_key=os.environ.get("NEWS_API_KEY"))
-        return newsapi.get_everything(q=query, language=language, sort_by="relevancy", page_size=page_size)
+        newsapi = _get_news_client()
+        result = newsapi.get_everything(q=query, language=language, sort_by="relevancy", page_size=page_size)
     except Exception as e:
         return {"error": str(e)}
 
+    # Only cache successful responses so errors are retried on the next call
+    if result.get("status") == "ok":
+        with _NEWS_CACHE_LOCK:
+            _NEWS_CACHE[key] = result
+    return copy.deepcopy(result)
+
 NEWS_INSTRUCTION_TEMPLATE = """You are an expert News Gathering Agent for an early warning system designed to prevent crowd-related incidents like stampedes.
         Your job is to find relevant external context for the following location: {location}.
         You should use your tools to search for information that could indicate a potential for dangerous crowd gatherings or stampedes.
@@ -132,7 +250,7 @@ NEWS_INSTRUCTION_TEMPLATE = """You are an expert News Gathering Agent for an ear
         }}
         ```
 """
-formatted_news_instruction = NEWS_INSTRUCTION_TEMPLATE.format(location=target_location)
+formatted_news_instruction = _normalize_instruction(NEWS_INSTRUCTION_TEMPLATE.format(location=target_location))
 
 news_gatherer_agent = RetryingAgent(
     name="news_gatherer",
@@ -154,7 +272,7 @@ The JSON object should include the original data from the GCS file along with yo
 ```json
 {{ "analysis": {{ "risk_category": "High", "justification": "Density score has spiked..." }}, "original_data": {{ "timestamp": "...", "location": "...", "total_count": "...", "density_score": "...", "flow_rate": "...", "risk_level": "...", "risk_score": "...", "anomaly_type": "...", "high_density_zones": [], "clusters": [] }} }}
 ```"""
-formatted_ml_instruction = ML_INSTRUCTION_TEMPLATE.format(gcs_path=GCS_PATH)
+formatted_ml_instruction = _normalize_instruction(ML_INSTRUCTION_TEMPLATE.format(gcs_path=GCS_PATH))
 
 ml_stats_analyzer_agent = RetryingAgent(
     name="ml_stats_analyzer",
@@ -208,7 +326,7 @@ stampede_predictor_agent = RetryingAgent(
     name="stampede_predictor",
     model="gemini-2.5-flash",
     description="Synthesizes ML stats and external news to predict stampede risk.",
-    instruction=STAMPEDE_PREDICTOR_INSTRUCTION,
+    instruction=_normalize_instruction(STAMPEDE_PREDICTOR_INSTRUCTION),
 )
 
 # --- 4. New Email Notification Agent ---
@@ -229,17 +347,19 @@ Your goal is to transform this JSON into a professional, visually appealing HTML
 4.  **Tone**: Professional, urgent, and clear.
 
 **Execution:**
-1.  Construct the HTML string.
-2.  Call `send_email_alert` with the subject "URGENT: CrowdGuard Risk Assessment - [Risk Level]" and the generated HTML content.
-3.  Output a simple confirmation message.
+1.  If the input report contains an 'error' key, do not send an email; output the error object unchanged and stop.
+2.  Construct the HTML string.
+3.  Call `send_email_alert` with the subject "URGENT: CrowdGuard Risk Assessment - [Risk Level]" and the generated HTML content.
+    If you need to send more than one email (e.g. one per high-density zone), call `send_email_alerts` once with all of them instead, passing the subjects and HTML bodies as two lists in the same order.
+4.  Output a simple confirmation message.
 """
 
 email_notifier_agent = RetryingAgent(
     name="email_notifier",
     model="gemini-2.5-flash-lite",
-    tools=[send_email_alert],
+    tools=[send_email_alert, send_email_alerts],
     description="Formats the risk report into HTML and sends an email notification.",
-    instruction=EMAIL_AGENT_INSTRUCTION
+    instruction=_normalize_instruction(EMAIL_AGENT_INSTRUCTION)
 )
 
 # --- Pipeline Assembly ---
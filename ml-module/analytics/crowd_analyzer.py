@@ -1,12 +1,15 @@
 """Advanced crowd analytics: density, heatmaps, anomalies."""
 import cv2
 import numpy as np
-from typing import List, Dict, Tuple, Optional
+from numba import njit
+from typing import List, Dict, Tuple, Optional, Union
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import pdist, squareform
 from sklearn.cluster import DBSCAN
 from dataclasses import dataclass, asdict
 from enum import Enum
 import sys
+import threading
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
@@ -15,9 +18,13 @@ from config import (
     HIGH_DENSITY_THRESHOLD,
     ANOMALY_MOVEMENT_THRESHOLD,
     CLUSTERING_EPS,
-    MIN_CLUSTER_SIZE
+    MIN_CLUSTER_SIZE,
+    USE_OPENCL
 )
 
+# OpenCV T-API: UMat operations dispatch to OpenCL kernels when a device is available
+OPENCL_ENABLED = USE_OPENCL and cv2.ocl.haveOpenCL()
+
 
 class RiskLevel(str, Enum):
     """Risk level classification."""
@@ -36,6 +43,123 @@ class AnomalyType(str, Enum):
     NORMAL = "normal"
 
 
+# Lower bounds of MEDIUM / HIGH / CRITICAL risk scores
+_RISK_THRESHOLDS = np.array([25.0, 50.0, 75.0])
+_RISK_LEVELS = (RiskLevel.LOW, RiskLevel.MEDIUM, RiskLevel.HIGH, RiskLevel.CRITICAL)
+_ANOMALY_TYPES = (
+    AnomalyType.NORMAL,
+    AnomalyType.SUDDEN_MOVEMENT,
+    AnomalyType.HIGH_DENSITY,
+    AnomalyType.CLUSTERING,
+    AnomalyType.RUSH_BEHAVIOR
+)
+
+
+# JIT-compiled per-frame kernels. They work on plain numbers/arrays and
+# return indices into _RISK_LEVELS / _ANOMALY_TYPES; CrowdAnalyzer wraps them.
+
+@njit(cache=True)
+def _density_score(person_count, frame_area):
+    if frame_area == 0:
+        return 0.0
+        
+    # Assume 1 person per 2m² is normal, 1 person per 0.5m² is critical
+    # Frame area in pixels, normalized to square meters (rough estimate)
+    pixels_per_sqm = 10000  # Approximate
+    frame_area_sqm = frame_area / pixels_per_sqm
+    
+    density = person_count / max(frame_area_sqm, 1.0)
+    
+    # Normalize to 0-100 scale
+    # 0.5 people/m² = 50, 2 people/m² = 100 (critical)
+    return np.round(min(density / 2 * 100, 100.0), 2)
+
+
+@njit(cache=True)
+def _grid_counts(centers, grid_size, counts):
+    # Fills the caller-owned (grid_h, grid_w) buffer in place
+    grid_h, grid_w = counts.shape
+    counts[:] = 0
+    for k in range(centers.shape[0]):
+        grid_x = min(max(int(centers[k, 0] / grid_size), 0), grid_w - 1)
+        grid_y = min(max(int(centers[k, 1] / grid_size), 0), grid_h - 1)
+        counts[grid_y, grid_x] += 1
+    return counts
+
+
+@njit(cache=True)
+def _splat_density(centers, scale, frame_h, frame_w, out):
+    # Accumulates in-frame centers into the caller-owned coarse grid; returns how many landed
+    out[:] = 0.0
+    hits = 0
+    for k in range(centers.shape[0]):
+        x = centers[k, 0]
+        y = centers[k, 1]
+        if x < 0 or x >= frame_w or y < 0 or y >= frame_h:
+            continue
+        out[int(y) // scale, int(x) // scale] += 1.0
+        hits += 1
+    return hits
+
+
+@njit(cache=True)
+def _risk_core(person_count, density_score, zone_count, avg_velocity):
+    # Factor 1: Density (40% weight)
+    risk_score = density_score * 0.4
+    # Factor 2: High-density zones (30% weight)
+    risk_score += min(zone_count * 10.0, 30.0)
+    # Factor 3: Movement velocity (20% weight)
+    risk_score += min(avg_velocity / ANOMALY_MOVEMENT_THRESHOLD * 20, 20.0)
+    # Factor 4: Absolute count (10% weight)
+    risk_score += min(person_count / 100 * 10, 10.0)
+    risk_score = min(risk_score, 100.0)
+    
+    risk_idx = np.searchsorted(_RISK_THRESHOLDS, risk_score, side="right")
+    
+    # Anomaly type (indices into _ANOMALY_TYPES)
+    anomaly_idx = 0
+    if avg_velocity > ANOMALY_MOVEMENT_THRESHOLD:
+        anomaly_idx = 1
+    elif zone_count > 3:
+        anomaly_idx = 2
+    elif density_score > 70:
+        anomaly_idx = 3
+    if risk_idx == 3:
+        anomaly_idx = 4
+        
+    return risk_score, risk_idx, anomaly_idx
+
+
+@njit(cache=True)
+def _analyze_core(centers, frame_area, grid_size, counts, avg_velocity):
+    person_count = centers.shape[0]
+    density_score = _density_score(person_count, frame_area)
+    _grid_counts(centers, grid_size, counts)
+    zone_count = int((counts >= HIGH_DENSITY_THRESHOLD).sum())
+    risk_score, risk_idx, anomaly_idx = _risk_core(
+        person_count, density_score, zone_count, avg_velocity
+    )
+    return density_score, counts, risk_score, risk_idx, anomaly_idx
+
+
+def extract_centers(detections) -> np.ndarray:
+    """
+    Pull detection centers into an (N, 2) float64 array.
+    
+    Detection records with a ``centers`` array are converted directly; lists
+    of dicts are streamed straight into the array buffer instead of building
+    an intermediate list of lists.
+    """
+    centers = getattr(detections, "centers", None)
+    if centers is not None:
+        return np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    return np.fromiter(
+        (coord for det in detections for coord in det["center"]),
+        dtype=np.float64,
+        count=2 * len(detections)
+    ).reshape(-1, 2)
+
+
 @dataclass
 class CrowdMetrics:
     """Crowd analysis metrics."""
@@ -48,7 +172,7 @@ class CrowdMetrics:
     clusters: List[Dict]
     avg_velocity: float
     frame_area: int
-    timestamp: str
+    timestamp: Union[str, int]  # ISO string or epoch nanoseconds, as passed to analyze()
 
 
 class CrowdAnalyzer:
@@ -65,9 +189,24 @@ class CrowdAnalyzer:
         self.frame_area = self.frame_height * self.frame_width
         self.grid_size = DENSITY_GRID_SIZE
         
+        # Density grid is fixed by the frame shape; the count buffer is reused every frame
+        self.grid_h = self.frame_height // self.grid_size
+        self.grid_w = self.frame_width // self.grid_size
+        self._grid_counts = np.zeros((self.grid_h, self.grid_w), dtype=np.int32)
+        
         # History for tracking changes
         self.previous_positions = None
         self.previous_timestamp = None
+
+        # Scatter and colormap buffers for heatmaps, allocated on first use and reused across frames
+        self._heatmap_buf = None
+        self._heatmap_bgr = None
+        self._heatmap_umat = None  # OpenCL counterparts, see _apply_heatmap_overlay_ocl
+        self._blend_umat = None
+        self._umat_shape = None
+
+        # Guards the reused buffers and movement history when shared across threads
+        self.lock = threading.Lock()
         
     def calculate_density_score(self, person_count: int) -> float:
         """
@@ -75,27 +214,13 @@ class CrowdAnalyzer:
         
         Formula: (people / area) * normalization_factor
         """
-        if self.frame_area == 0:
-            return 0.0
-            
-        # Assume 1 person per 2m² is normal, 1 person per 0.5m² is critical
-        # Frame area in pixels, normalized to square meters (rough estimate)
-        pixels_per_sqm = 10000  # Approximate
-        frame_area_sqm = self.frame_area / pixels_per_sqm
-        
-        density = person_count / max(frame_area_sqm, 1)
-        
-        # Normalize to 0-100 scale
-        # 0.5 people/m² = 50, 2 people/m² = 100 (critical)
-        density_score = min(density / 2 * 100, 100)
-        
-        return round(density_score, 2)
+        return round(float(_density_score(person_count, self.frame_area)), 2)
     
     def create_density_heatmap(
         self,
         centers: np.ndarray,
         sigma: int = 30
-    ) -> np.ndarray:
+    ) -> Optional[np.ndarray]:
         """
         Create a density heatmap using Gaussian kernels.
         
@@ -104,50 +229,97 @@ class CrowdAnalyzer:
             sigma: Standard deviation for Gaussian blur
             
         Returns:
-            Heatmap as numpy array
+            Heatmap as numpy array, or None if no point falls inside the frame
         """
-        heatmap = np.zeros((self.frame_height, self.frame_width), dtype=np.float32)
-        
         if len(centers) == 0:
-            return heatmap
+            return None
             
-        for x, y in centers:
-            if 0 <= x < self.frame_width and 0 <= y < self.frame_height:
-                heatmap[int(y), int(x)] += 1
+        # The blur is wide, so accumulate and smooth on a coarse grid; only the
+        # final uint8 map is produced at full resolution
+        scale = max(1, int(sigma) // 15)
+        coarse_h = -(-self.frame_height // scale)
+        coarse_w = -(-self.frame_width // scale)
+        
+        # Scatter in-frame points into the reused buffer in one compiled pass
+        if self._heatmap_buf is None or self._heatmap_buf.shape != (coarse_h, coarse_w):
+            self._heatmap_buf = np.empty((coarse_h, coarse_w), dtype=np.float32)
+        heatmap = self._heatmap_buf
+        if _splat_density(np.asarray(centers), scale, self.frame_height, self.frame_width, heatmap) == 0:
+            return None
                 
-        # Apply Gaussian blur for smooth heatmap
-        heatmap = cv2.GaussianBlur(heatmap, (0, 0), sigma)
-        
-        # Normalize to 0-255
-        if heatmap.max() > 0:
-            heatmap = (heatmap / heatmap.max() * 255).astype(np.uint8)
+        # Approximate the Gaussian blur with three box-filter passes (cost independent of sigma);
+        # BORDER_REFLECT mirrors about the coarse cell edge, which is the frame edge
+        box_size = int(round(np.sqrt(12 * (sigma / scale) ** 2 / 3 + 1))) | 1
+        for _ in range(3):
+            cv2.boxFilter(
+                heatmap, -1, (box_size, box_size), dst=heatmap, borderType=cv2.BORDER_REFLECT
+            )
+        
+        # Normalize to 0-255 and upsample straight into a uint8 map
+        heatmap = cv2.convertScaleAbs(heatmap, alpha=255.0 / max(float(heatmap.max()), 1e-6))
+        heatmap = cv2.resize(
+            heatmap,
+            (self.frame_width, self.frame_height),
+            interpolation=cv2.INTER_LINEAR
+        )
             
         return heatmap
     
     def apply_heatmap_overlay(
         self,
         frame: np.ndarray,
-        heatmap: np.ndarray,
-        alpha: float = 0.5
+        heatmap: Optional[np.ndarray],
+        alpha: float = 0.5,
+        inplace: bool = False
     ) -> np.ndarray:
         """
         Overlay heatmap on original frame.
         
         Args:
             frame: Original BGR frame
-            heatmap: Grayscale heatmap
+            heatmap: Grayscale heatmap (None leaves the frame untouched)
             alpha: Transparency (0-1)
+            inplace: Blend directly into frame instead of a new array
             
         Returns:
             Frame with heatmap overlay
         """
-        # Apply colormap (red = high density)
-        heatmap_colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+        if heatmap is None:
+            return frame
+            
+        if OPENCL_ENABLED:
+            return self._apply_heatmap_overlay_ocl(frame, heatmap, alpha, inplace)
+            
+        # Apply colormap (red = high density) into the reused buffer
+        if self._heatmap_bgr is None or self._heatmap_bgr.shape[:2] != heatmap.shape:
+            self._heatmap_bgr = np.empty(heatmap.shape + (3,), dtype=np.uint8)
+        cv2.applyColorMap(heatmap, cv2.COLORMAP_JET, dst=self._heatmap_bgr)
         
         # Blend with original frame
-        overlay = cv2.addWeighted(frame, 1 - alpha, heatmap_colored, alpha, 0)
+        return cv2.addWeighted(
+            frame, 1 - alpha, self._heatmap_bgr, alpha, 0, dst=frame if inplace else None
+        )
         
-        return overlay
+    def _apply_heatmap_overlay_ocl(
+        self,
+        frame: np.ndarray,
+        heatmap: np.ndarray,
+        alpha: float,
+        inplace: bool
+    ) -> np.ndarray:
+        """Colormap and blend on the OpenCL device into reused device buffers; only the result is read back."""
+        if self._umat_shape != heatmap.shape:
+            self._heatmap_umat = cv2.UMat(heatmap.shape[0], heatmap.shape[1], cv2.CV_8UC3)
+            self._blend_umat = cv2.UMat(heatmap.shape[0], heatmap.shape[1], cv2.CV_8UC3)
+            self._umat_shape = heatmap.shape
+        cv2.applyColorMap(cv2.UMat(heatmap), cv2.COLORMAP_JET, dst=self._heatmap_umat)
+        cv2.addWeighted(cv2.UMat(frame), 1 - alpha, self._heatmap_umat, alpha, 0, dst=self._blend_umat)
+        
+        blended = self._blend_umat.get()
+        if inplace:
+            np.copyto(frame, blended)
+            return frame
+        return blended
     
     def detect_high_density_zones(
         self,
@@ -165,37 +337,32 @@ class CrowdAnalyzer:
         if len(centers) == 0:
             return []
             
-        # Create grid
-        grid_h = self.frame_height // self.grid_size
-        grid_w = self.frame_width // self.grid_size
-        
         # Count people per grid cell
-        grid_counts = np.zeros((grid_h, grid_w), dtype=np.int32)
-        
-        for x, y in centers:
-            grid_x = min(int(x / self.grid_size), grid_w - 1)
-            grid_y = min(int(y / self.grid_size), grid_h - 1)
-            grid_counts[grid_y, grid_x] += 1
-            
-        # Find high-density zones
-        high_density_zones = []
-        for i in range(grid_h):
-            for j in range(grid_w):
-                count = grid_counts[i, j]
-                if count >= HIGH_DENSITY_THRESHOLD:
-                    zone = {
-                        "grid_position": [j, i],
-                        "bbox": [
-                            j * self.grid_size,
-                            i * self.grid_size,
-                            (j + 1) * self.grid_size,
-                            (i + 1) * self.grid_size
-                        ],
-                        "person_count": int(count),
-                        "density_level": "critical" if count > HIGH_DENSITY_THRESHOLD * 2 else "high"
-                    }
-                    high_density_zones.append(zone)
-                    
+        grid_counts = _grid_counts(
+            np.asarray(centers, dtype=np.float64),
+            self.grid_size,
+            self._grid_counts
+        )
+        return self._zones_from_counts(grid_counts)
+    
+    def _zones_from_counts(self, grid_counts: np.ndarray) -> List[Dict]:
+        """Build zone dicts for grid cells at or above the density threshold."""
+        # Find high-density zones (only visit cells above threshold)
+        ys, xs = np.where(grid_counts >= HIGH_DENSITY_THRESHOLD)
+        counts = grid_counts[ys, xs]
+        x1s = xs * self.grid_size
+        y1s = ys * self.grid_size
+
+        high_density_zones = [
+            {
+                "grid_position": [int(j), int(i)],
+                "bbox": [int(x1), int(y1), int(x1 + self.grid_size), int(y1 + self.grid_size)],
+                "person_count": int(count),
+                "density_level": "critical" if count > HIGH_DENSITY_THRESHOLD * 2 else "high"
+            }
+            for i, j, x1, y1, count in zip(ys, xs, x1s, y1s, counts)
+        ]
+
         return high_density_zones
     
     def detect_clusters(self, centers: np.ndarray) -> List[Dict]:
@@ -211,33 +378,42 @@ class CrowdAnalyzer:
         if len(centers) < MIN_CLUSTER_SIZE:
             return []
             
-        # Run DBSCAN clustering
-        clustering = DBSCAN(eps=CLUSTERING_EPS, min_samples=MIN_CLUSTER_SIZE)
+        # Run DBSCAN clustering (ball tree index for the 2-D neighbor queries)
+        clustering = DBSCAN(
+            eps=CLUSTERING_EPS,
+            min_samples=MIN_CLUSTER_SIZE,
+            algorithm="ball_tree",
+            leaf_size=40
+        )
         labels = clustering.fit_predict(centers)
         
-        # Analyze clusters
-        clusters = []
-        unique_labels = set(labels)
+        # Group points by label once, dropping noise points (-1)
+        keep = labels != -1
+        if not keep.any():
+            return []
+        order = np.argsort(labels[keep], kind="stable")
+        sorted_labels = labels[keep][order]
+        sorted_points = centers[keep][order]
+        unique_labels, starts, sizes = np.unique(
+            sorted_labels, return_index=True, return_counts=True
+        )
+        
+        # Per-cluster statistics via segmented reductions
+        mins = np.minimum.reduceat(sorted_points, starts, axis=0)
+        maxs = np.maximum.reduceat(sorted_points, starts, axis=0)
+        means = np.add.reduceat(sorted_points, starts, axis=0) / sizes[:, None]
         
-        for label in unique_labels:
-            if label == -1:  # Noise points
-                continue
-                
-            cluster_points = centers[labels == label]
-            cluster_center = cluster_points.mean(axis=0)
-            
-            # Calculate bounding box
-            x_min, y_min = cluster_points.min(axis=0)
-            x_max, y_max = cluster_points.max(axis=0)
-            
-            cluster = {
+        clusters = [
+            {
                 "cluster_id": int(label),
-                "size": len(cluster_points),
-                "center": cluster_center.tolist(),
+                "size": int(size),
+                "center": center.tolist(),
                 "bbox": [int(x_min), int(y_min), int(x_max), int(y_max)],
                 "area": int((x_max - x_min) * (y_max - y_min))
             }
-            clusters.append(cluster)
+            for label, size, center, (x_min, y_min), (x_max, y_max)
+            in zip(unique_labels, sizes, means, mins, maxs)
+        ]
             
         # Sort by size (largest first)
         clusters.sort(key=lambda x: x["size"], reverse=True)
@@ -259,6 +435,8 @@ class CrowdAnalyzer:
         Returns:
             Average velocity in pixels/second
         """
+        current_positions = np.asarray(current_positions, dtype=np.float32)
+
         if self.previous_positions is None or len(current_positions) == 0:
             self.previous_positions = current_positions
             return 0.0
@@ -268,20 +446,15 @@ class CrowdAnalyzer:
             self.previous_positions = current_positions
             return 0.0
             
-        velocities = []
-        for curr_pos in current_positions:
-            # Find closest previous position
-            distances = np.linalg.norm(self.previous_positions - curr_pos, axis=1)
-            min_dist = distances.min()
-            
-            if min_dist < 200:  # Only consider if within reasonable range
-                velocity = min_dist / max(time_delta, 0.001)
-                velocities.append(velocity)
+        # Single KD-tree query; matches beyond 200px come back as inf
+        tree = cKDTree(self.previous_positions)
+        distances, _ = tree.query(current_positions, k=1, distance_upper_bound=200)
+        matched = distances[np.isfinite(distances)]
                 
         self.previous_positions = current_positions
         
-        if velocities:
-            return float(np.mean(velocities))
+        if len(matched) > 0:
+            return float(np.mean(matched / max(time_delta, 0.001)))
         return 0.0
     
     def classify_risk(
@@ -303,63 +476,26 @@ class CrowdAnalyzer:
         Returns:
             (risk_level, risk_score, anomaly_type)
         """
-        # Calculate risk score
-        risk_score = 0.0
-        
-        # Factor 1: Density (40% weight)
-        risk_score += density_score * 0.4
-        
-        # Factor 2: High-density zones (30% weight)
-        zone_factor = min(len(high_density_zones) * 10, 30)
-        risk_score += zone_factor
-        
-        # Factor 3: Movement velocity (20% weight)
-        velocity_factor = min(avg_velocity / ANOMALY_MOVEMENT_THRESHOLD * 20, 20)
-        risk_score += velocity_factor
-        
-        # Factor 4: Absolute count (10% weight)
-        count_factor = min(person_count / 100 * 10, 10)
-        risk_score += count_factor
-        
-        risk_score = min(risk_score, 100)
-        
-        # Classify risk level
-        if risk_score < 25:
-            risk_level = RiskLevel.LOW
-        elif risk_score < 50:
-            risk_level = RiskLevel.MEDIUM
-        elif risk_score < 75:
-            risk_level = RiskLevel.HIGH
-        else:
-            risk_level = RiskLevel.CRITICAL
-            
-        # Detect anomaly type
-        anomaly_type = AnomalyType.NORMAL
-        
-        if avg_velocity > ANOMALY_MOVEMENT_THRESHOLD:
-            anomaly_type = AnomalyType.SUDDEN_MOVEMENT
-        elif len(high_density_zones) > 3:
-            anomaly_type = AnomalyType.HIGH_DENSITY
-        elif density_score > 70:
-            anomaly_type = AnomalyType.CLUSTERING
-            
-        if risk_level == RiskLevel.CRITICAL:
-            anomaly_type = AnomalyType.RUSH_BEHAVIOR
-            
-        return risk_level, round(risk_score, 2), anomaly_type
+        risk_score, risk_idx, anomaly_idx = _risk_core(
+            person_count,
+            float(density_score),
+            len(high_density_zones),
+            float(avg_velocity)
+        )
+        return _RISK_LEVELS[risk_idx], round(float(risk_score), 2), _ANOMALY_TYPES[anomaly_idx]
     
     def analyze(
         self,
-        detections: List[Dict],
-        timestamp: str,
+        detections,
+        timestamp: Union[str, int],
         time_delta: float = 0.33
     ) -> CrowdMetrics:
         """
         Perform comprehensive crowd analysis.
         
         Args:
-            detections: List of person detections
-            timestamp: Current timestamp
+            detections: Person detections (Detections record or list of dicts)
+            timestamp: Current timestamp (ISO string or time.time_ns() value)
             time_delta: Time since last frame (seconds)
             
         Returns:
@@ -368,24 +504,24 @@ class CrowdAnalyzer:
         person_count = len(detections)
         
         # Extract centers
-        if person_count > 0:
-            centers = np.array([det["center"] for det in detections])
-        else:
-            centers = np.array([])
+        centers = extract_centers(detections)
             
-        # Calculate metrics
-        density_score = self.calculate_density_score(person_count)
-        high_density_zones = self.detect_high_density_zones(centers)
+        # Movement and clustering stay in scipy/sklearn; the rest runs in one JIT kernel
         clusters = self.detect_clusters(centers)
         avg_velocity = self.calculate_movement(centers, time_delta)
         
-        # Classify risk
-        risk_level, risk_score, anomaly_type = self.classify_risk(
-            person_count,
-            density_score,
-            high_density_zones,
-            avg_velocity
+        density_score, grid_counts, risk_score, risk_idx, anomaly_idx = _analyze_core(
+            centers,
+            self.frame_area,
+            self.grid_size,
+            self._grid_counts,
+            float(avg_velocity)
         )
+        high_density_zones = self._zones_from_counts(grid_counts)
+        density_score = round(float(density_score), 2)
+        risk_level = _RISK_LEVELS[risk_idx]
+        risk_score = round(float(risk_score), 2)
+        anomaly_type = _ANOMALY_TYPES[anomaly_idx]
         
         return CrowdMetrics(
             total_count=person_count,
@@ -399,6 +535,72 @@ class CrowdAnalyzer:
             frame_area=self.frame_area,
             timestamp=timestamp
         )
+    
+    def analyze_batch(
+        self,
+        batch_detections: List,
+        timestamps: List[str],
+        time_deltas: Optional[List[float]] = None
+    ) -> List[CrowdMetrics]:
+        """
+        Analyze several consecutive frames in one call.
+        
+        Grid histograms for the whole batch are built with a single
+        bincount; movement is still tracked frame by frame, in order.
+        
+        Args:
+            batch_detections: Per-frame person detections
+            timestamps: Per-frame timestamps
+            time_deltas: Per-frame time since previous frame (seconds)
+            
+        Returns:
+            One CrowdMetrics object per frame, in input order
+        """
+        batch_size = len(batch_detections)
+        if time_deltas is None:
+            time_deltas = [0.33] * batch_size
+            
+        # Stack all centers with a frame index per point
+        person_counts = np.array([len(dets) for dets in batch_detections], dtype=np.int64)
+        centers_list = [extract_centers(dets) for dets in batch_detections]
+        all_centers = np.concatenate(centers_list) if batch_size else np.empty((0, 2))
+        batch_index = np.repeat(np.arange(batch_size), person_counts)
+        
+        # Count people per grid cell for every frame at once
+        grid_h, grid_w = self.grid_h, self.grid_w
+        grid_cells = grid_h * grid_w
+        grid_x = np.clip((all_centers[:, 0] / self.grid_size).astype(np.int64), 0, grid_w - 1)
+        grid_y = np.clip((all_centers[:, 1] / self.grid_size).astype(np.int64), 0, grid_h - 1)
+        flat_idx = batch_index * grid_cells + grid_y * grid_w + grid_x
+        grid_counts = np.bincount(flat_idx, minlength=batch_size * grid_cells).reshape(
+            batch_size, grid_h, grid_w
+        )
+        zone_counts = (grid_counts >= HIGH_DENSITY_THRESHOLD).sum(axis=(1, 2))
+        
+        results = []
+        for i in range(batch_size):
+            person_count = int(person_counts[i])
+            density_score = round(float(_density_score(person_count, self.frame_area)), 2)
+            clusters = self.detect_clusters(centers_list[i])
+            avg_velocity = self.calculate_movement(centers_list[i], time_deltas[i])
+            risk_score, risk_idx, anomaly_idx = _risk_core(
+                person_count, density_score, int(zone_counts[i]), float(avg_velocity)
+            )
+            
+            results.append(CrowdMetrics(
+                total_count=person_count,
+                density_score=density_score,
+                risk_level=_RISK_LEVELS[risk_idx],
+                risk_score=round(float(risk_score), 2),
+                anomaly_type=_ANOMALY_TYPES[anomaly_idx],
+                high_density_zones=self._zones_from_counts(grid_counts[i]),
+                clusters=clusters,
+                avg_velocity=round(avg_velocity, 2),
+                frame_area=self.frame_area,
+                timestamp=timestamps[i]
+            ))
+            
+        return results
 
 
 def test_analyzer():
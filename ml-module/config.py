@@ -20,14 +20,49 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "")
 GCS_STATS_FILE = os.getenv("GCS_STATS_FILE", "")
 
 # ML Model Configuration
-YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8m.pt")  # Medium model for better accuracy
+YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8n.pt")  # Nano model for fast person detection
 YOLO_MODEL_PATH = MODELS_DIR / YOLO_MODEL
 CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.2"))  # Balanced for accuracy
 IOU_THRESHOLD = float(os.getenv("IOU_THRESHOLD", "0.3"))  # Lower to detect overlapping people
+MAX_DETECTIONS = int(os.getenv("MAX_DETECTIONS", "500"))  # Detection budget for dense crowds
+BASE_MAX_DETECTIONS = int(os.getenv("BASE_MAX_DETECTIONS", "100"))  # Budget while recent frames are sparse
+
+# Micro-batching for concurrent websocket/API frames
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))  # Max frames per YOLO forward
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "5"))  # Max time to wait for a batch to fill
+
+# TensorRT INT8 engine (CUDA hosts only); loaded if present, exported from YOLO_MODEL_PATH
+# only when INT8_CALIBRATION_DATA is supplied
+USE_TENSORRT = os.getenv("USE_TENSORRT", "true").lower() == "true"
+# Built with a dynamic batch axis up to MAX_BATCH; the batch is in the name so a rebuild follows MAX_BATCH
+ENGINE_PATH = Path(os.getenv("ENGINE_PATH", str(YOLO_MODEL_PATH.with_name(f"{YOLO_MODEL_PATH.stem}_b{MAX_BATCH}.engine"))))
+ENGINE_IMGSZ = int(os.getenv("ENGINE_IMGSZ", "1280"))
+# Dataset yaml of crowd frames: 'train' split calibrates, held-out 'val' split checks accuracy.
+# Empty skips INT8 export entirely
+INT8_CALIBRATION_DATA = os.getenv("INT8_CALIBRATION_DATA", "")
+INT8_MAX_MAP_DROP = float(os.getenv("INT8_MAX_MAP_DROP", "0.01"))  # Max relative mAP50-95 loss vs the PyTorch model
+USE_FP16 = os.getenv("USE_FP16", "true").lower() == "true"  # Half-precision inference on CUDA hosts
+# int8 | fp16 | fp32; empty picks fp16 on CUDA and fp32 on CPU. int8 is opt-in
+DETECTOR_PRECISION = os.getenv("DETECTOR_PRECISION", "").lower()
+
+# OpenVINO INT8 model (CPU-only hosts), opt-in: runs at a fixed OPENVINO_IMGSZ instead of the
+# adaptive 640/1280, and a missing model is exported (needs INT8_CALIBRATION_DATA) at startup.
+# Needs requirements-openvino.txt (Docker: --build-arg WITH_OPENVINO=true)
+USE_OPENVINO = os.getenv("USE_OPENVINO", "false").lower() == "true"
+OPENVINO_PATH = Path(os.getenv("OPENVINO_PATH", str(MODELS_DIR / f"{YOLO_MODEL_PATH.stem}_b{MAX_BATCH}_openvino_model")))
+OPENVINO_IMGSZ = int(os.getenv("OPENVINO_IMGSZ", "640"))  # 4x less compute than 1280 on CPU
 
 # Video Processing Configuration
 FRAME_SAMPLE_RATE = int(os.getenv("FRAME_SAMPLE_RATE", "3"))  # Process every Nth frame
 MAX_VIDEO_SIZE_MB = int(os.getenv("MAX_VIDEO_SIZE_MB", "500"))
+VIDEO_PREFETCH_FRAMES = int(os.getenv("VIDEO_PREFETCH_FRAMES", "16"))  # Decoded frames buffered ahead of detection
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "8"))  # Sampled frames per detector call for video files
+PIN_PIPELINE_THREADS = os.getenv("PIN_PIPELINE_THREADS", "false").lower() == "true"  # Give each video pipeline its own decode/encode cores (Linux)
+MAX_FRAME_SIZE = int(os.getenv("MAX_FRAME_SIZE", "1280"))  # Longest side for annotated frame API responses
+MAX_STORED_FRAMES = int(os.getenv("MAX_STORED_FRAMES", "64"))  # Annotated frame files kept for /api/frame before the oldest is deleted
+# Opt-in: heatmap compositing via OpenCL when a device is present. Frames are uploaded and read back
+# around the colormap/blend, so enable it only where a benchmark shows that beats the CPU path
+USE_OPENCL = os.getenv("USE_OPENCL", "false").lower() == "true"
 
 # Crowd Analytics Thresholds
 DENSITY_GRID_SIZE = 50  # pixels per grid cell
@@ -39,3 +74,4 @@ MIN_CLUSTER_SIZE = 10  # Minimum people for crowd cluster
 # API Configuration
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8080"))
+STATS_UPLOAD_INTERVAL_MS = float(os.getenv("STATS_UPLOAD_INTERVAL_MS", "1000"))  # Window for coalescing stats uploads
@@ -1,37 +1,249 @@
 """YOLO-based object detection for crowd monitoring."""
+import asyncio
 import cv2
 import numpy as np
+import torch
+from dataclasses import dataclass
 from typing import List, Dict, Tuple
 from ultralytics import YOLO
 from pathlib import Path
+import shutil
 import sys
+import threading
 
 sys.path.append(str(Path(__file__).parent.parent))
-from config import YOLO_MODEL_PATH, CONFIDENCE_THRESHOLD, IOU_THRESHOLD
+from config import (
+    YOLO_MODEL_PATH,
+    CONFIDENCE_THRESHOLD,
+    IOU_THRESHOLD,
+    MAX_DETECTIONS,
+    BASE_MAX_DETECTIONS,
+    USE_TENSORRT,
+    ENGINE_PATH,
+    ENGINE_IMGSZ,
+    INT8_CALIBRATION_DATA,
+    INT8_MAX_MAP_DROP,
+    USE_FP16,
+    DETECTOR_PRECISION,
+    USE_OPENVINO,
+    OPENVINO_PATH,
+    OPENVINO_IMGSZ,
+    MAX_BATCH,
+    MAX_WAIT_MS
+)
+
+PRECISIONS = ("int8", "fp16", "fp32")
+
+# Annotation limits for crowded frames
+MAX_LABELED_DETECTIONS = 50  # Skip confidence labels above this many people
+SMALL_BOX_WIDTH = 30  # Boxes narrower than this (pixels) are drawn 1px thick
+
+
+@dataclass
+class Detections:
+    """Person detections for one frame, stored as parallel arrays."""
+    xyxy: np.ndarray  # (N, 4) int32 boxes
+    confidence: np.ndarray  # (N,) float32 scores
+    centers: np.ndarray  # (N, 2) int32 box centers
+    areas: np.ndarray  # (N,) int64 box areas
+    
+    def __len__(self) -> int:
+        return len(self.xyxy)
+    
+    @classmethod
+    def empty(cls) -> "Detections":
+        """Create a record with no detections."""
+        return cls(
+            xyxy=np.empty((0, 4), dtype=np.int32),
+            confidence=np.empty(0, dtype=np.float32),
+            centers=np.empty((0, 2), dtype=np.int32),
+            areas=np.empty(0, dtype=np.int64)
+        )
+    
+    def scaled(self, factor: float) -> "Detections":
+        """Return a copy with coordinates scaled by factor (e.g. back to the original frame size)."""
+        return Detections(
+            xyxy=(self.xyxy * factor).astype(np.int32),
+            confidence=self.confidence,
+            centers=(self.centers * factor).astype(np.int32),
+            areas=(self.areas * factor * factor).astype(np.int64)
+        )
+    
+    def to_list_of_dicts(self) -> List[Dict]:
+        """Materialize the JSON-friendly list of detection dicts."""
+        return [
+            {
+                "bbox": bbox,
+                "confidence": confidence,
+                "class": "person",
+                "center": center,
+                "area": area
+            }
+            for bbox, confidence, center, area in zip(
+                self.xyxy.tolist(),
+                self.confidence.tolist(),
+                self.centers.tolist(),
+                self.areas.tolist()
+            )
+        ]
 
 
 class CrowdDetector:
     """Real-time crowd detection using YOLOv8."""
     
-    def __init__(self, model_path: str = None):
-        """Initialize the detector with YOLO model."""
+    def __init__(self, model_path: str = None, precision: str = None):
+        """
+        Initialize the detector with YOLO model.
+        
+        Args:
+            model_path: PyTorch weights to load (and export from)
+            precision: "int8" prefers the quantized TensorRT/OpenVINO model,
+                "fp16" runs the PyTorch model in half precision on CUDA,
+                "fp32" runs it at full precision; defaults to DETECTOR_PRECISION,
+                else fp16 on CUDA and fp32 on CPU
+        """
+        precision = precision or DETECTOR_PRECISION or ("fp16" if torch.cuda.is_available() else "fp32")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+            
         self.model_path = model_path or YOLO_MODEL_PATH
+        self.precision = precision
         self.model = None
+        self.model_name = None
+        self.fixed_imgsz = None  # Set when the loaded model only accepts one input size
+        self.device = 0 if torch.cuda.is_available() else 'cpu'
+        self.half = precision != "fp32" and USE_FP16 and torch.cuda.is_available()  # FP16 tensor cores on GPU only
+        self.max_det = BASE_MAX_DETECTIONS  # Adapted to recent crowd sizes
+        self.avg_count = 0.0
+        self._lock = threading.Lock()  # Ultralytics predictors are not thread-safe
         self.load_model()
+        if torch.cuda.is_available():
+            self.warmup()
         
     def load_model(self):
-        """Load YOLOv8 model."""
+        """Load YOLOv8 model; at int8 precision prefer a TensorRT engine (CUDA) or OpenVINO model (CPU)."""
+        if self.precision == "int8" and self._load_int8_model():
+            return
+            
         try:
             self.model = YOLO(str(self.model_path))
-            print(f"✅ Loaded YOLO model from {self.model_path}")
+            self.model_name = Path(self.model_path).stem
+            print(f"✅ Loaded YOLO model {self.model_name} from {self.model_path}")
         except Exception as e:
             print(f"❌ Error loading YOLO model: {e}")
             # Try downloading the model
             print("📥 Downloading YOLOv8-Nano model...")
             self.model = YOLO('yolov8n.pt')
-            self.model.export(format='pt')
+            self.model_name = 'yolov8n'
             
-    def detect_people(self, frame: np.ndarray) -> List[Dict]:
+    def _load_int8_model(self) -> bool:
+        """Load the INT8 TensorRT engine (CUDA) or OpenVINO model (CPU). Returns False if unavailable."""
+        if torch.cuda.is_available():
+            if USE_TENSORRT:
+                self.model = self._load_exported_model(
+                    ENGINE_PATH,
+                    "TensorRT INT8 engine",
+                    format='engine',
+                    int8=True,
+                    half=False,
+                    dynamic=True,
+                    imgsz=ENGINE_IMGSZ,
+                    batch=MAX_BATCH,
+                    workspace=4
+                )
+                if self.model is not None:
+                    self.fixed_imgsz = ENGINE_IMGSZ
+                    self.model_name = ENGINE_PATH.stem
+                    return True
+        elif USE_OPENVINO:
+            self.model = self._load_exported_model(
+                OPENVINO_PATH,
+                "OpenVINO INT8 model",
+                format='openvino',
+                int8=True,
+                dynamic=True,
+                imgsz=OPENVINO_IMGSZ,
+                batch=MAX_BATCH
+            )
+            if self.model is not None:
+                self.fixed_imgsz = OPENVINO_IMGSZ
+                self.model_name = OPENVINO_PATH.stem
+                return True
+                
+        return False
+        
+    def warmup(self, runs: int = 2):
+        """
+        Run dummy frames at every inference size the detector uses.
+        
+        Sets up the Ultralytics predictor and lets the cuDNN autotuner pick
+        kernels for each input shape before the first real request.
+        
+        Args:
+            runs: Forward passes per input size
+        """
+        sizes = [self.fixed_imgsz] if self.fixed_imgsz else [640, 1280]
+        for imgsz in sizes:
+            dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+            for _ in range(runs):
+                self._predict(dummy, imgsz)
+        print(f"🔥 Warmed up model at imgsz {sizes}")
+        
+    def _load_exported_model(self, target: Path, label: str, **export_args):
+        """
+        Load an INT8 model, exporting it once if missing. Returns None on failure.
+        
+        Exports calibrate on the 'train' split of INT8_CALIBRATION_DATA and are
+        discarded unless they hold accuracy on its 'val' split.
+        """
+        try:
+            if not target.exists():
+                if not INT8_CALIBRATION_DATA:
+                    print(f"ℹ️ No {label} at {target} and no INT8_CALIBRATION_DATA set, using PyTorch model")
+                    return None
+                    
+                print(f"⚙️ Exporting {label} (one-time, may take several minutes)...")
+                exported = Path(YOLO(str(self.model_path)).export(
+                    data=INT8_CALIBRATION_DATA, split='train', **export_args
+                ))
+                if not self._int8_accuracy_ok(exported, export_args['imgsz']):
+                    if exported.is_dir():
+                        shutil.rmtree(exported)
+                    else:
+                        exported.unlink()
+                    return None
+                if exported != target:
+                    exported.replace(target)
+                    
+            model = YOLO(str(target), task='detect')
+            print(f"✅ Loaded {label} from {target}")
+            return model
+        except Exception as e:
+            print(f"⚠️ {label} unavailable, falling back to PyTorch model: {e}")
+            return None
+            
+    def _int8_accuracy_ok(self, exported: Path, imgsz: int) -> bool:
+        """Check an INT8 export against the PyTorch model on the held-out 'val' split."""
+        val_args = dict(
+            data=INT8_CALIBRATION_DATA,
+            split='val',
+            imgsz=imgsz,
+            classes=[0],
+            device=self.device,
+            plots=False,
+            verbose=False
+        )
+        reference = YOLO(str(self.model_path)).val(**val_args).box.map
+        quantized = YOLO(str(exported), task='detect').val(**val_args).box.map
+        drop = (reference - quantized) / max(reference, 1e-6)
+        
+        print(f"📏 INT8 person mAP50-95 {quantized:.3f} vs {reference:.3f} ({drop:.1%} drop)")
+        if drop > INT8_MAX_MAP_DROP:
+            print(f"⚠️ INT8 accuracy drop exceeds {INT8_MAX_MAP_DROP:.1%}, discarding {exported}")
+            return False
+        return True
+        
+    def detect_people(self, frame: np.ndarray) -> Detections:
         """
         Detect people in a frame with crowd-optimized settings.
         
@@ -39,88 +251,186 @@ class CrowdDetector:
             frame: Input image as numpy array (BGR format)
             
         Returns:
-            List of detections with bounding boxes and metadata
+            Detections with bounding boxes and metadata
+        """
+        if self.model is None:
+            raise RuntimeError("Model not loaded")
+        
+        return self._detect([frame], self._imgsz_for(frame))[0]
+    
+    def detect_people_batch(self, frames: List[np.ndarray]) -> List[Detections]:
+        """
+        Detect people in several frames with one forward pass per input size.
+        
+        Args:
+            frames: Input images as numpy arrays (BGR format)
+            
+        Returns:
+            Per-frame Detections, in the same order as frames
         """
         if self.model is None:
             raise RuntimeError("Model not loaded")
         
-        # Get frame dimensions
-        height, width = frame.shape[:2]
+        if len(frames) == 1:
+            return [self.detect_people(frames[0])]
+        
+        # Exported models run one imgsz, with at most MAX_BATCH frames per forward
+        if self.fixed_imgsz is not None:
+            batch_detections: List[Detections] = []
+            for start in range(0, len(frames), MAX_BATCH):
+                batch_detections.extend(self._detect(frames[start:start + MAX_BATCH], self.fixed_imgsz))
+            return batch_detections
+        
+        # Group frames by inference size so each frame keeps its usual imgsz
+        groups: Dict[int, List[int]] = {}
+        for i, frame in enumerate(frames):
+            groups.setdefault(self._imgsz_for(frame), []).append(i)
+            
+        batch_detections: List[Detections] = [None] * len(frames)
+        for imgsz, indices in groups.items():
+            detections = self._detect([frames[i] for i in indices], imgsz)
+            for i, dets in zip(indices, detections):
+                batch_detections[i] = dets
+                
+        return batch_detections
+    
+    def input_scale(self, shape: Tuple[int, ...]) -> float:
+        """
+        Get the factor that shrinks a frame to its inference size.
+        
+        Frames resized by this factor before detection skip the model's own
+        resize; scale the resulting detections by its inverse.
         
+        Args:
+            shape: Frame shape; only (height, width) is used
+            
+        Returns:
+            Scale factor, at most 1.0
+        """
+        longest = max(shape[0], shape[1])
+        return min(1.0, self._imgsz_for_side(longest) / longest)
+    
+    def _imgsz_for(self, frame: np.ndarray) -> int:
+        """Pick the inference size for a frame."""
+        return self._imgsz_for_side(max(frame.shape[:2]))
+    
+    def _imgsz_for_side(self, longest: int) -> int:
+        """Pick the inference size for a frame's longest side."""
         # Use larger image size for better small person detection
-        imgsz = 1280 if max(height, width) > 640 else 640
+        # (static engines are built for a single input size)
+        return self.fixed_imgsz or (1280 if longest > 640 else 640)
+    
+    def _detect(self, frames: List[np.ndarray], imgsz: int) -> List[Detections]:
+        """Run frames at the adaptive detection budget, widening it for saturated frames."""
+        detections = []
+        
+        # Serialize model use across the batcher, video and stream threads
+        with self._lock:
+            max_det = self.max_det
+            results = self._predict(frames, imgsz, max_det)
             
-        # Run inference with crowd-optimized parameters
-        results = self.model(
-            frame,
+            for frame, result in zip(frames, results):
+                # Hitting the budget means people may have been cut off
+                if len(result.boxes) >= max_det and max_det < MAX_DETECTIONS:
+                    result = self._predict(frame, imgsz, MAX_DETECTIONS)[0]
+                self._update_max_det(len(result.boxes))
+                detections.append(self._parse_result(result))
+                
+        return detections
+    
+    def _update_max_det(self, count: int) -> None:
+        """Track a moving average of crowd size and pick the budget for the next frame."""
+        self.avg_count = 0.9 * self.avg_count + 0.1 * count
+        if self.avg_count >= 0.8 * BASE_MAX_DETECTIONS:
+            self.max_det = MAX_DETECTIONS
+        else:
+            self.max_det = BASE_MAX_DETECTIONS
+    
+    def _predict(self, source, imgsz: int, max_det: int = MAX_DETECTIONS):
+        """Run inference with crowd-optimized parameters."""
+        return self.model(
+            source,
             conf=CONFIDENCE_THRESHOLD,
             iou=IOU_THRESHOLD,
             classes=[0],  # 0 = person in COCO dataset
             verbose=False,
             imgsz=imgsz,  # Larger image size for better detection
+            device=self.device,
+            half=self.half,
             agnostic_nms=True,  # Better for overlapping objects
-            max_det=500  # Allow more detections for crowds
+            max_det=max_det  # Fewer slots means less NMS and output copy work
+        )
+    
+    def _parse_result(self, result) -> Detections:
+        """Convert one Ultralytics result into a Detections record."""
+        boxes = result.boxes
+        if len(boxes) == 0:
+            return Detections.empty()
+            
+        # One device-to-host copy per tensor, then vectorized box math
+        xyxy = boxes.xyxy.cpu().numpy()
+        return Detections(
+            xyxy=xyxy.astype(np.int32),
+            confidence=boxes.conf.cpu().numpy(),
+            centers=((xyxy[:, :2] + xyxy[:, 2:]) / 2).astype(np.int32),
+            areas=((xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])).astype(np.int64)
         )
-        
-        detections = []
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = float(box.conf[0])
-                class_id = int(box.cls[0])
-                
-                detection = {
-                    "bbox": [int(x1), int(y1), int(x2), int(y2)],
-                    "confidence": confidence,
-                    "class": "person",
-                    "center": [int((x1 + x2) / 2), int((y1 + y2) / 2)],
-                    "area": int((x2 - x1) * (y2 - y1))
-                }
-                detections.append(detection)
-                
-        return detections
     
     def draw_detections(
         self,
         frame: np.ndarray,
-        detections: List[Dict],
-        show_confidence: bool = True
+        detections: Detections,
+        show_confidence: bool = True,
+        out: np.ndarray = None,
+        inplace: bool = False
     ) -> np.ndarray:
         """
         Draw bounding boxes on frame.
         
         Args:
             frame: Input image
-            detections: List of detections from detect_people()
-            show_confidence: Whether to show confidence scores
+            detections: Detections from detect_people()
+            show_confidence: Whether to show confidence scores (skipped for crowded frames)
+            out: Optional caller-owned buffer (same shape as frame) to draw into
+            inplace: Draw directly on frame when the caller doesn't need the original
             
         Returns:
             Annotated frame
         """
-        annotated_frame = frame.copy()
-        
-        for det in detections:
-            x1, y1, x2, y2 = det["bbox"]
-            confidence = det["confidence"]
-            
-            # Draw bounding box
-            color = (0, 255, 0)  # Green
-            cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
-            
-            # Draw label
-            if show_confidence:
-                label = f"Person {confidence:.2f}"
-                cv2.putText(
-                    annotated_frame,
-                    label,
-                    (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    color,
-                    2
-                )
-                
+        if inplace:
+            annotated_frame = frame
+        elif out is not None:
+            np.copyto(out, frame)
+            annotated_frame = out
+        else:
+            annotated_frame = frame.copy()
+            
+        color = (0, 255, 0)  # Green
+        
+        if len(detections) > 0:
+            xyxy = detections.xyxy
+            
+            # Draw all bounding boxes as closed polygons, one call per line thickness
+            corners = xyxy[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+            small = (xyxy[:, 2] - xyxy[:, 0]) < SMALL_BOX_WIDTH
+            for mask, thickness in ((~small, 2), (small, 1)):
+                if mask.any():
+                    cv2.polylines(annotated_frame, list(corners[mask]), True, color, thickness)
+                    
+            # Draw labels (a crowd view doesn't benefit from per-person text)
+            if show_confidence and len(detections) <= MAX_LABELED_DETECTIONS:
+                for (x1, y1, _, _), confidence in zip(xyxy.tolist(), detections.confidence.tolist()):
+                    label = f"Person {confidence:.2f}"
+                    cv2.putText(
+                        annotated_frame,
+                        label,
+                        (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5,
+                        color,
+                        2
+                    )
+                    
         # Draw count
         count_text = f"People: {len(detections)}"
         cv2.putText(
@@ -135,19 +445,105 @@ class CrowdDetector:
         
         return annotated_frame
     
-    def get_detection_centers(self, detections: List[Dict]) -> np.ndarray:
+    def get_detection_centers(self, detections: Detections) -> np.ndarray:
         """
         Extract center coordinates of all detections.
         
         Args:
-            detections: List of detections
+            detections: Detections from detect_people()
             
         Returns:
             Numpy array of shape (N, 2) with center coordinates
         """
-        if not detections:
-            return np.array([])
-        return np.array([det["center"] for det in detections])
+        return detections.centers
+
+
+class BatchedDetector:
+    """Micro-batches concurrent detect_people calls into a single YOLO forward."""
+    
+    def __init__(
+        self,
+        detector: CrowdDetector,
+        max_batch: int = MAX_BATCH,
+        max_wait_ms: float = MAX_WAIT_MS
+    ):
+        """
+        Initialize the batching wrapper.
+        
+        Args:
+            detector: Detector that runs the batched forward passes
+            max_batch: Maximum frames per forward pass
+            max_wait_ms: Maximum time to wait for a batch to fill
+        """
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._task = None
+        self._loop = None
+        
+    async def submit(self, frame: np.ndarray) -> Detections:
+        """
+        Queue a frame for detection and wait for its result.
+        
+        Args:
+            frame: Input image as numpy array (BGR format)
+            
+        Returns:
+            Detections, as returned by detect_people()
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queue and scheduler are bound to the loop they were created on
+            self._queue = asyncio.Queue()
+            self._task = None
+            self._loop = loop
+        if self._task is None or self._task.done():
+            # (Re)start the scheduler; frames still queued are picked up by the new task
+            self._task = asyncio.create_task(self._run())
+            
+        future = loop.create_future()
+        await self._queue.put((frame, future))
+        return await future
+    
+    async def _run(self):
+        """Gather queued frames into batches and run them."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.max_wait
+                
+                # Collect more frames until the batch is full or the window closes
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                        
+                frames = [frame for frame, _ in batch]
+                try:
+                    # Run inference off the event loop; this task is the only model user
+                    results = await asyncio.to_thread(self.detector.detect_people_batch, frames)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                    
+                for (_, future), detections in zip(batch, results):
+                    if not future.done():
+                        future.set_result(detections)
+        finally:
+            # Don't leave callers of an in-flight batch waiting on a stopped scheduler
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
 
 
 def test_detector():
@@ -190,7 +586,7 @@ def test_detector():
     print(f"✅ Saved annotated image to {output_path}")
     
     # Print detection details
-    for i, det in enumerate(detections[:5]):  # Show first 5
+    for i, det in enumerate(detections.to_list_of_dicts()[:5]):  # Show first 5
         print(f"Person {i+1}: confidence={det['confidence']:.2f}, center={det['center']}")
 
 
@@ -4,22 +4,21 @@ from pathlib import Path
 import sys
 
 sys.path.append(str(Path(__file__).parent))
-from config import MODELS_DIR
+from config import YOLO_MODEL_PATH
 
 
 def download_model():
-    """Download YOLOv8-Medium model for better accuracy."""
-    print("📥 Downloading YOLOv8-Medium model...")
+    """Download YOLOv8-Nano model for fast person detection."""
+    print("📥 Downloading YOLOv8-Nano model...")
     
     try:
-        # This will automatically download the model
-        model = YOLO('yolov8m.pt')
+        # This will automatically download the model into the models directory
+        model_path = YOLO_MODEL_PATH
+        model = YOLO(str(model_path))
         
-        # Save to models directory
-        model_path = MODELS_DIR / 'yolov8m.pt'
         print(f"✅ Model downloaded successfully to {model_path}")
-        print(f"📊 Model size: ~50MB")
-        print(f"⚡ Inference speed: ~15-20ms on CPU, ~3-5ms on GPU")
+        print(f"📊 Model size: ~6MB")
+        print(f"⚡ Inference speed: ~5-8ms on CPU, ~1-2ms on GPU")
         
         # Test the model
         print("\n🧪 Testing model...")
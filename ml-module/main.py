@@ -1,28 +1,46 @@
 """FastAPI service for ML module."""
 from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
 import asyncio
 import uuid
+from collections import deque
+import aiofiles
 from pathlib import Path
 import sys
 import subprocess
-import shutil
+from contextlib import closing
 import numpy as np
 from datetime import datetime
-import base64
 import requests
-from PIL import Image
-import io
+import cv2
+import torch
 
 sys.path.append(str(Path(__file__).parent.parent))
-from config import API_HOST, API_PORT, TEMP_DIR, GCS_BUCKET_NAME, GCS_STATS_FILE, GOOGLE_CLOUD_PROJECT
+from config import (
+    API_HOST,
+    API_PORT,
+    TEMP_DIR,
+    GCS_BUCKET_NAME,
+    GCS_STATS_FILE,
+    GOOGLE_CLOUD_PROJECT,
+    USE_FP16,
+    STATS_UPLOAD_INTERVAL_MS,
+    MAX_FRAME_SIZE,
+    MAX_STORED_FRAMES
+)
 from processing.video_processor import VideoProcessor
+from detection.detector import BatchedDetector
 from google.cloud import storage
-import json
+import orjson
+
+# Enable TF32 matmuls and cuDNN autotuning (imgsz is bounded to 640/1280)
+if USE_FP16 and torch.cuda.is_available():
+    torch.set_float32_matmul_precision('high')
+    torch.backends.cudnn.benchmark = True
 
 app = FastAPI(
     title="CrowdGuard AI - ML Module",
@@ -42,33 +60,43 @@ app.add_middleware(
 # Global processor
 processor = VideoProcessor()
 
+# Batches frames from concurrent websocket/API callers into one forward pass
+batched_detector = BatchedDetector(processor.detector)
+
 # Active websocket connections
 active_connections: List[WebSocket] = []
 
-# GCS client (initialize once)
+# Uploaded videos are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Annotated frame files served by /api/frame, oldest first
+stored_frames = deque()
+
+# GCS client and stats blob (initialize once)
 gcs_client = None
+stats_blob = None
 if GOOGLE_CLOUD_PROJECT and GCS_BUCKET_NAME:
     try:
         gcs_client = storage.Client(project=GOOGLE_CLOUD_PROJECT)
+        stats_blob = gcs_client.bucket(GCS_BUCKET_NAME).blob(GCS_STATS_FILE)
     except Exception as e:
         print(f"⚠️ Warning: Could not initialize GCS client: {e}")
 
 
 def write_stats_to_gcs(stats_data: dict) -> bool:
     """Write crowd statistics to GCS with fixed filename."""
-    if not gcs_client:
+    if not stats_blob:
         print("⚠️ GCS client not initialized, skipping upload")
         return False
     
     try:
-        bucket = gcs_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(GCS_STATS_FILE)
-        
-        # Convert to JSON and upload
-        json_data = json.dumps(stats_data, indent=2)
-        blob.upload_from_string(
+        # Convert to JSON and upload in a single request (compact; the file is machine-consumed).
+        # No retry: a newer payload replaces this one within the next upload window
+        json_data = orjson.dumps(stats_data, option=orjson.OPT_SERIALIZE_NUMPY)
+        stats_blob.upload_from_string(
             json_data,
-            content_type='application/json'
+            content_type='application/json',
+            retry=None
         )
         
         print(f"✅ Stats written to gs://{GCS_BUCKET_NAME}/{GCS_STATS_FILE}")
@@ -78,6 +106,57 @@ def write_stats_to_gcs(stats_data: dict) -> bool:
         return False
 
 
+class StatsUploader:
+    """Coalesces frequent stats writes so only the newest payload is uploaded."""
+    
+    def __init__(self, interval_ms: float = STATS_UPLOAD_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._pending = None
+        self._task = None
+        
+    def submit(self, stats_data: dict) -> None:
+        """Queue stats for upload, replacing any payload not yet written."""
+        self._pending = stats_data
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+            
+    async def _flush(self) -> None:
+        """Upload the newest pending payload every interval until none is left."""
+        while self._pending is not None:
+            await asyncio.sleep(self.interval)
+            stats_data, self._pending = self._pending, None
+            await asyncio.to_thread(write_stats_to_gcs, stats_data)
+
+
+# High-rate stats uploads (websocket and frame API) run off the request path
+stats_uploader = StatsUploader()
+
+
+def analyze_locked(analyzer, detections, timestamp: str):
+    """Run analyzer.analyze while holding the analyzer's lock (it may be shared across threads)."""
+    with analyzer.lock:
+        return analyzer.analyze(detections, timestamp)
+
+
+def store_frame(frame_filename: str, data: bytes) -> None:
+    """Save an annotated frame, deleting the oldest ones beyond MAX_STORED_FRAMES."""
+    (TEMP_DIR / frame_filename).write_bytes(data)
+    stored_frames.append(frame_filename)
+    while len(stored_frames) > MAX_STORED_FRAMES:
+        try:
+            evicted = stored_frames.popleft()
+        except IndexError:
+            break
+        (TEMP_DIR / evicted).unlink(missing_ok=True)
+
+
+def decode_frame(data: bytes) -> Optional[np.ndarray]:
+    """Decode an encoded image into a BGR frame, or None if it is not a valid image."""
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
 class HealthResponse(BaseModel):
     status: str
     model_loaded: bool
@@ -129,60 +208,84 @@ async def analyze_video(
     """
     Analyze uploaded video file and create annotated version.
     
-    Returns frame-by-frame analysis results and path to annotated video.
+    Streams frame-by-frame analysis results as NDJSON, followed by a
+    summary line with the path to the annotated video.
     """
     try:
-        # Save uploaded file
+        # Save uploaded file in chunks so memory stays flat for large videos
         timestamp = datetime.now().timestamp()
         file_path = TEMP_DIR / f"{timestamp}_{file.filename}"
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
         
-        # Create annotated video path
+        # Create annotated video and results paths
         output_filename = f"{timestamp}_annotated.mp4"
         output_path = TEMP_DIR / output_filename
+        results_path = TEMP_DIR / f"{timestamp}_results.ndjson"
         
-        # Process video using ultralytics directly (it handles video I/O internally)
-        results = []
-        frame_count = 0
-        
-        for result in processor.process_video_file(str(file_path)):
-            metrics = result["metrics"]
-            annotated_frame = result["annotated_frame"]
-            
-            frame_result = {
-                "frame_idx": result["frame_idx"],
-                "timestamp": result["timestamp"],
-                "total_count": metrics.total_count,
-                "density_score": metrics.density_score,
-                "risk_level": metrics.risk_level.value,
-                "risk_score": metrics.risk_score,
-                "anomaly_type": metrics.anomaly_type.value,
-                "detections": result["detections"],
-                "high_density_zones": metrics.high_density_zones,
-                "clusters": metrics.clusters
-            }
-            results.append(frame_result)
-            frame_count += 1
-            
-            # Limit processing for large videos
-            if frame_count >= 300:  # Process max 10 seconds at 30fps
-                break
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
         
-        # Copy the original video as "annotated" (since we're not actually annotating)
-        shutil.copy(str(file_path), str(output_path))
+    # Reject unreadable uploads before the 200 streaming response starts
+    if await asyncio.to_thread(processor.probe_file, str(file_path)) is None:
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable video")
         
-        # Cleanup original upload
-        file_path.unlink()
+    def stream_results():
+        """Yield one NDJSON line per processed frame, then a summary line."""
+        # Running aggregates instead of holding every frame in memory
+        max_frame = None
+        total_sum = 0
+        frame_count = 0
         
-        # Write stats to GCS - include both max and sum
-        if results:
-            # Find frame with maximum people count
-            max_frame = max(results, key=lambda x: x["total_count"])
-            # Calculate sum of all people across all frames
-            total_sum = sum(r["total_count"] for r in results)
+        try:
+            # Decoding and annotated-video encoding run on background threads
+            with closing(processor.process_video_file(str(file_path), output_path=str(output_path))) as frames, \
+                    open(results_path, "wb") as results_file:
+                for result in frames:
+                    metrics = result["metrics"]
+                    
+                    frame_result = {
+                        "frame_idx": result["frame_idx"],
+                        "timestamp": datetime.fromtimestamp(result["timestamp_ns"] / 1e9).isoformat(),
+                        "total_count": metrics.total_count,
+                        "density_score": metrics.density_score,
+                        "risk_level": metrics.risk_level.value,
+                        "risk_score": metrics.risk_score,
+                        "anomaly_type": metrics.anomaly_type.value,
+                        "detections": result["detections"].to_list_of_dicts(),
+                        "high_density_zones": metrics.high_density_zones,
+                        "clusters": metrics.clusters
+                    }
+                    
+                    # Track frame with maximum people count and sum across all frames
+                    if max_frame is None or frame_result["total_count"] > max_frame["total_count"]:
+                        max_frame = frame_result
+                    total_sum += frame_result["total_count"]
+                    frame_count += 1
+                    
+                    # Save to the results file and stream to the client
+                    line = orjson.dumps(
+                        frame_result,
+                        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+                    )
+                    results_file.write(line)
+                    yield line
+                    
+                    # Limit processing for large videos
+                    if frame_count >= 300:  # Process max 10 seconds at 30fps
+                        break
+        except Exception as e:
+            # Failures after the response has started can only be reported in-stream
+            yield orjson.dumps({"status": "error", "detail": str(e)}, option=orjson.OPT_APPEND_NEWLINE)
+            return
+        finally:
+            # Cleanup original upload (annotated video is fully written once the generator closes)
+            file_path.unlink(missing_ok=True)
             
+        # Write stats to GCS - include both max and sum
+        if max_frame is not None:
             stats_payload = {
                 "timestamp": max_frame["timestamp"],
                 "location": location or "Video Analysis",
@@ -197,31 +300,21 @@ async def analyze_video(
                 "high_density_zones": max_frame["high_density_zones"],
                 "clusters": max_frame["clusters"]
             }
+            # Written before the summary line so anything reading GCS after it sees this video.
+            # This generator runs in Starlette's threadpool, so the blocking upload stays off the event loop
             write_stats_to_gcs(stats_payload)
             
             # Agent call is now handled by frontend only
             # Backend just writes to GCS and lets frontend call the agent
-        
-        # Save results to JSON file
-        results_filename = f"{timestamp}_results.json"
-        results_path = TEMP_DIR / results_filename
-        with open(results_path, "w") as json_file:
-            json.dump({
-                "status": "success",
-                "total_frames_analyzed": len(results),
-                "annotated_video_url": f"/api/video/{output_filename}",
-                "results": results
-            }, json_file, indent=2)
-        
-        return {
+            
+        yield orjson.dumps({
             "status": "success",
-            "total_frames_analyzed": len(results),
-            "annotated_video_url": f"/api/video/{output_filename}",
-            "results": results
-        }
+            "total_frames_analyzed": frame_count,
+            "annotated_video_url": f"/api/video/{output_filename}"
+        }, option=orjson.OPT_APPEND_NEWLINE)
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Sync generators are iterated in a worker thread, off the event loop
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 
 @app.get("/api/video/{filename}")
@@ -233,6 +326,15 @@ async def get_video(filename: str):
     return FileResponse(file_path, media_type="video/mp4")
 
 
+@app.get("/api/frame/{filename}")
+async def get_frame(filename: str):
+    """Serve annotated frame image."""
+    file_path = TEMP_DIR / filename
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Frame not found")
+    return FileResponse(file_path, media_type="image/jpeg")
+
+
 @app.post("/api/analyze/frame")
 async def analyze_frame(file: UploadFile = File(...)):
     """
@@ -241,39 +343,51 @@ async def analyze_frame(file: UploadFile = File(...)):
     Returns detection and crowd analysis.
     """
     try:
-        # Read image
+        # Read image (decode off the event loop)
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        frame = np.array(image.convert('RGB'))
+        frame = await asyncio.to_thread(decode_frame, contents)
         
         if frame is None:
             raise HTTPException(status_code=400, detail="Invalid image file")
             
-        # Initialize analyzer if needed
-        height, width = frame.shape[:2]
-        if processor.analyzer is None:
-            from analytics.crowd_analyzer import CrowdAnalyzer
-            processor.analyzer = CrowdAnalyzer((height, width))
-            
-        # Detect and analyze
-        detections = processor.detector.detect_people(frame)
-        timestamp = datetime.now().isoformat()
-        metrics = processor.analyzer.analyze(detections, timestamp)
+        # Analyzer matching the uploaded resolution
+        analyzer = processor.get_analyzer(frame.shape)
+        
+        # Downscale large uploads once; detection, annotation and JPEG encoding run at display size
+        scale = MAX_FRAME_SIZE / max(frame.shape[:2])
+        if scale < 1:
+            frame = await asyncio.to_thread(
+                cv2.resize, frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        display_analyzer = processor.get_analyzer(frame.shape)
         
-        # Create annotated frame
-        annotated = processor.detector.draw_detections(frame, detections)
+        # Detect (batched forward runs in a worker thread)
+        detections = await batched_detector.submit(frame)
+        full_detections = detections.scaled(1 / scale) if scale < 1 else detections
+        timestamp = datetime.now().isoformat()
+        frame_filename = f"{uuid.uuid4().hex}.jpg"
         
-        # Add heatmap
-        if len(detections) > 0:
-            centers = np.array([det["center"] for det in detections])
-            heatmap = processor.analyzer.create_density_heatmap(centers)
-            annotated = processor.analyzer.apply_heatmap_overlay(annotated, heatmap, 0.3)
+        def analyze_and_render():
+            """Analyze, annotate and save the frame; runs in a worker thread."""
+            # Analysis uses original coordinates so density and zones are unchanged
+            with analyzer.lock:
+                metrics = analyzer.analyze(full_detections, timestamp)
+                
+            # Create annotated frame
+            annotated = processor.detector.draw_detections(frame, detections, inplace=True)
+            
+            # Add heatmap
+            if len(detections) > 0:
+                with display_analyzer.lock:
+                    heatmap = display_analyzer.create_density_heatmap(detections.centers)
+                    annotated = display_analyzer.apply_heatmap_overlay(annotated, heatmap, 0.3, inplace=True)
+                
+            # Encode annotated frame and serve it out-of-band instead of inlining base64
+            _, buffer = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            store_frame(frame_filename, buffer.tobytes())
+            return metrics
             
-        # Encode annotated frame
-        annotated_image = Image.fromarray(annotated)
-        buffer = io.BytesIO()
-        annotated_image.save(buffer, format='JPEG')
-        annotated_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        metrics = await asyncio.to_thread(analyze_and_render)
         
         # Prepare stats for GCS
         stats_payload = {
@@ -290,8 +404,8 @@ async def analyze_frame(file: UploadFile = File(...)):
             "clusters": metrics.clusters
         }
         
-        # Write to GCS
-        write_stats_to_gcs(stats_payload)
+        # Write to GCS in the background
+        stats_uploader.submit(stats_payload)
         
         return {
             "status": "success",
@@ -301,10 +415,10 @@ async def analyze_frame(file: UploadFile = File(...)):
             "risk_level": metrics.risk_level.value,
             "risk_score": metrics.risk_score,
             "anomaly_type": metrics.anomaly_type.value,
-            "detections": detections,
+            "detections": full_detections.to_list_of_dicts(),
             "high_density_zones": metrics.high_density_zones,
             "clusters": metrics.clusters,
-            "annotated_frame": annotated_base64
+            "annotated_frame_url": f"/api/frame/{frame_filename}"
         }
         
     except Exception as e:
@@ -321,34 +435,49 @@ async def websocket_stream(websocket: WebSocket):
     await websocket.accept()
     active_connections.append(websocket)
     
+    # Only the newest received frame is kept; older ones are dropped while a frame is processed
+    latest_data = None
+    frame_ready = asyncio.Event()
+    
+    async def receive_frames():
+        nonlocal latest_data
+        try:
+            while True:
+                latest_data = await websocket.receive_bytes()
+                frame_ready.set()
+        finally:
+            latest_data = None
+            frame_ready.set()
+            
+    receiver = asyncio.create_task(receive_frames())
+    
     try:
         while True:
-            # Receive frame data
-            data = await websocket.receive_bytes()
-            
-            # Decode frame
-            try:
-                image = Image.open(io.BytesIO(data))
-                frame = np.array(image.convert('RGB'))
-            except Exception:
-                frame = None
+            # Wait for the newest frame data
+            await frame_ready.wait()
+            frame_ready.clear()
+            data, latest_data = latest_data, None
+            if data is None:
+                await receiver  # Re-raises the disconnect/receive error
+                break
+                
+            # Decode frame (BGR, as the detector expects) off the event loop
+            frame = await asyncio.to_thread(decode_frame, data)
             
             if frame is None:
                 await websocket.send_json({"error": "Invalid frame"})
                 continue
                 
-            # Initialize analyzer if needed
-            height, width = frame.shape[:2]
-            if processor.analyzer is None:
-                from analytics.crowd_analyzer import CrowdAnalyzer
-                processor.analyzer = CrowdAnalyzer((height, width))
+            # Analyzer matching this frame's resolution
+            analyzer = processor.get_analyzer(frame.shape)
                 
-            # Process frame
-            detections = processor.detector.detect_people(frame)
+            # Process frame (detection and analysis run in worker threads)
+            detections = await batched_detector.submit(frame)
             timestamp = datetime.now().isoformat()
-            metrics = processor.analyzer.analyze(detections, timestamp)
+            metrics = await asyncio.to_thread(analyze_locked, analyzer, detections, timestamp)
             
-            # Send response
+            # Send response (same per-person detection records as the HTTP endpoints). orjson rejects
+            # structured numpy arrays, so the record shape needs a dict per person
             response = {
                 "timestamp": timestamp,
                 "total_count": metrics.total_count,
@@ -356,12 +485,12 @@ async def websocket_stream(websocket: WebSocket):
                 "risk_level": metrics.risk_level.value,
                 "risk_score": metrics.risk_score,
                 "anomaly_type": metrics.anomaly_type.value,
-                "detections": detections,
+                "detections": detections.to_list_of_dicts(),
                 "high_density_zones": metrics.high_density_zones,
                 "clusters": metrics.clusters
             }
             
-            # Write to GCS (every frame from websocket)
+            # Write to GCS (coalesced, newest frame wins)
             stats_payload = {
                 "timestamp": timestamp,
                 "location": "Live Stream",
@@ -375,13 +504,16 @@ async def websocket_stream(websocket: WebSocket):
                 "high_density_zones": metrics.high_density_zones,
                 "clusters": metrics.clusters
             }
-            write_stats_to_gcs(stats_payload)
+            stats_uploader.submit(stats_payload)
             
-            await websocket.send_json(response)
+            await websocket.send_text(
+                orjson.dumps(response, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            )
             
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
+        receiver.cancel()
         active_connections.remove(websocket)
 
 
@@ -389,7 +521,7 @@ async def websocket_stream(websocket: WebSocket):
 async def get_stats():
     """Get ML module statistics."""
     return {
-        "model_type": "YOLOv8-Nano",
+        "model_type": processor.detector.model_name,
         "active_connections": len(active_connections),
         "frames_processed": processor.frame_count,
         "timestamp": datetime.now().isoformat()
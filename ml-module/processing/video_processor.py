@@ -1,27 +1,171 @@
 """Video processing service for real-time and batch analysis."""
 import cv2
 import numpy as np
-from typing import Optional, Generator, Dict
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Generator, Dict, List, Tuple
 from pathlib import Path
+import os
+import queue
+import threading
 import time
-from datetime import datetime
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
-from config import FRAME_SAMPLE_RATE
+from config import FRAME_SAMPLE_RATE, VIDEO_PREFETCH_FRAMES, VIDEO_BATCH_SIZE, PIN_PIPELINE_THREADS
 from detection.detector import CrowdDetector
 from analytics.crowd_analyzer import CrowdAnalyzer
 
+MAX_CACHED_ANALYZERS = 8
+DEFAULT_FPS = 30.0  # Assumed when the container or stream doesn't report a frame rate
+
+
+def _reserve_pipeline_cores() -> List[int]:
+    """
+    Set aside cores for video reader and writer threads.
+    
+    Reserves a quarter of the cores this process may run on (an even number,
+    at least two) and moves the importing thread onto the rest, so threads it
+    starts later, including server workers running detection, inherit a mask
+    that keeps them off the reserved cores. Returns an empty list when pinning
+    is disabled, unsupported (macOS, Windows) or there are too few cores to spare.
+    """
+    if not PIN_PIPELINE_THREADS or not hasattr(os, "sched_getaffinity"):
+        return []
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < 4:
+        return []
+    reserved = cores[-max(2, len(cores) // 4 // 2 * 2):]
+    try:
+        os.sched_setaffinity(0, set(cores) - set(reserved))
+    except OSError as e:
+        print(f"⚠️ Could not reserve pipeline cores: {e}")
+        return []
+    return reserved
+
+
+class _CorePool:
+    """Hands each running video pipeline its own (reader, writer) core pair."""
+    
+    def __init__(self, cores: List[int]):
+        self._free = [(cores[i], cores[i + 1]) for i in range(0, len(cores) - 1, 2)]
+        self._lock = threading.Lock()
+        
+    def acquire(self) -> Tuple[Optional[int], Optional[int]]:
+        """Take a free core pair, or (None, None) to run unpinned when all are in use."""
+        with self._lock:
+            return self._free.pop() if self._free else (None, None)
+            
+    def release(self, pair: Tuple[Optional[int], Optional[int]]) -> None:
+        """Return a pair from acquire to the pool."""
+        if pair[0] is not None:
+            with self._lock:
+                self._free.append(pair)
+
+
+def _pin_current_thread(core: Optional[int]) -> None:
+    """Pin the calling thread to one core so it doesn't migrate across the detector's caches (Linux only)."""
+    if core is None:
+        return
+    try:
+        os.sched_setaffinity(threading.get_native_id(), {core})
+    except OSError as e:
+        print(f"⚠️ Could not pin thread to core {core}: {e}")
+
+
+PIPELINE_CORES = _CorePool(_reserve_pipeline_cores())
+
+
+@dataclass
+class CaptureInfo:
+    """Video capture properties, read once when a file or stream is opened."""
+    fps: float
+    width: int
+    height: int
+    frame_count: int  # 0 for live streams
+
+
+class _FrameRing:
+    """
+    Fixed pool of frame buffers shared by the video reader, processing and writer stages.
+    
+    The reader decodes into a free slot; each stage holding the slot releases
+    it when done, and the slot returns to the pool once nobody holds it.
+    """
+    
+    def __init__(self, size: int, shape: Tuple[int, ...]):
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self._refs = [0] * size
+        self._lock = threading.Lock()
+        self._free = queue.Queue()
+        for slot in range(size):
+            self._free.put(slot)
+            
+    def acquire(self) -> Optional[int]:
+        """Take a free slot (held once), blocking while all are in flight; None after unblock()."""
+        slot = self._free.get()
+        if slot is not None:
+            self._refs[slot] = 1
+        return slot
+        
+    def retain(self, slot: int) -> None:
+        """Add a holder to a slot."""
+        with self._lock:
+            self._refs[slot] += 1
+            
+    def release(self, slot: int) -> None:
+        """Drop a holder; the slot becomes free when none are left."""
+        with self._lock:
+            self._refs[slot] -= 1
+            if self._refs[slot] == 0:
+                self._free.put(slot)
+                
+    def unblock(self) -> None:
+        """Wake a reader waiting in acquire() during shutdown."""
+        self._free.put(None)
+
 
 class VideoProcessor:
     """Process video streams and files for crowd analysis."""
     
+    # Metrics overlay text color per risk level (BGR)
+    _RISK_COLORS = {
+        "CRITICAL": (0, 0, 255),
+        "HIGH": (0, 165, 255),
+        "MEDIUM": (0, 255, 255),
+        "LOW": (0, 255, 0)
+    }
+    
     def __init__(self):
         """Initialize video processor."""
         self.detector = CrowdDetector()
         self.analyzer = None
+        self.analyzers: "OrderedDict[Tuple[int, int], CrowdAnalyzer]" = OrderedDict()  # Live analyzers keyed by (height, width), least recently used first
+        self._metrics_text_cache = None  # (metric values, formatted overlay lines)
         self.frame_count = 0
         
+    def get_analyzer(self, shape: Tuple[int, ...]) -> CrowdAnalyzer:
+        """
+        Get the live-stream analyzer for a frame resolution, creating it on first use.
+        
+        Args:
+            shape: Frame shape; only (height, width) is used
+            
+        Returns:
+            CrowdAnalyzer configured for that resolution
+        """
+        key = (shape[0], shape[1])
+        analyzer = self.analyzers.get(key)
+        if analyzer is not None:
+            self.analyzers.move_to_end(key)
+            return analyzer
+            
+        # Keep only a few resolutions around, dropping the least recently used
+        if len(self.analyzers) >= MAX_CACHED_ANALYZERS:
+            self.analyzers.popitem(last=False)
+        analyzer = self.analyzers[key] = CrowdAnalyzer(key)
+        return analyzer
+        
     def process_video_file(
         self,
         video_path: str,
@@ -37,7 +181,8 @@ class VideoProcessor:
             show_preview: Whether to display video during processing
             
         Yields:
-            Dict with frame analysis results
+            Dict with frame analysis results; annotated_frame is a reused
+            buffer that is only valid until the next iteration
         """
         cap = cv2.VideoCapture(video_path)
         
@@ -45,102 +190,258 @@ class VideoProcessor:
             raise ValueError(f"Cannot open video: {video_path}")
             
         # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        info = self._probe(cap)
+        fps, width, height = info.fps, info.width, info.height
+        
+        print(f"📹 Video: {width}x{height} @ {fps}fps, {info.frame_count} frames")
         
-        print(f"📹 Video: {width}x{height} @ {fps}fps, {total_frames} frames")
+        # Frames above the model input size are shrunk once before detection
+        det_scale = self.detector.input_scale((height, width))
+        det_size = (round(width * det_scale), round(height * det_scale))
         
-        # Initialize analyzer with frame dimensions
-        self.analyzer = CrowdAnalyzer((height, width))
+        # Initialize analyzer with frame dimensions (local, so concurrent videos don't share history)
+        analyzer = self.analyzer = CrowdAnalyzer((height, width))
         
-        # Setup video writer if output path provided
+        # Setup video writer if output path provided (only sampled frames are written)
         writer = None
         if output_path:
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+            writer = self._open_writer(output_path, fps / FRAME_SAMPLE_RATE, (width, height))
             
-        frame_idx = 0
+        # Decode and encode run on their own threads; detection and the
+        # stateful analyzer stay on the calling thread. Frames are decoded into
+        # a fixed ring of buffers, which also bounds how far decode runs ahead.
+        ring = _FrameRing(VIDEO_PREFETCH_FRAMES + VIDEO_BATCH_SIZE, (height, width, 3))
+        read_q = queue.Queue(maxsize=VIDEO_PREFETCH_FRAMES)
+        write_q = queue.Queue(maxsize=VIDEO_PREFETCH_FRAMES)
+        stop_event = threading.Event()
+        cores = PIPELINE_CORES.acquire()
+        reader_core, writer_core = cores
+        
+        reader_thread = threading.Thread(
+            target=self._read_frames,
+            args=(cap, ring, read_q, stop_event, det_size if det_scale < 1 else None, reader_core),
+            daemon=True
+        )
+        reader_thread.start()
+        
+        writer_thread = None
+        if writer:
+            writer_thread = threading.Thread(
+                target=self._write_frames,
+                args=(writer, ring, write_q, writer_core),
+                daemon=True
+            )
+            writer_thread.start()
+            
+        processed_frames = 0
+        time_delta = FRAME_SAMPLE_RATE / fps  # Constant gap between sampled frames
         start_time = time.time()
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        try:
+            eof = False
+            while not eof:
+                # Collect a batch of sampled frames (shorter at EOF)
+                batch = []
+                while len(batch) < VIDEO_BATCH_SIZE:
+                    item = read_q.get()
+                    if item is None:
+                        eof = True
+                        break
+                    batch.append(item)
+                if not batch:
+                    break
+                    
+                # Detect people in the whole batch at once, back in original coordinates
+                batch_detections = self.detector.detect_people_batch([det_frame for *_, det_frame in batch])
+                if det_scale < 1:
+                    batch_detections = [dets.scaled(1 / det_scale) for dets in batch_detections]
                 
-            # Sample frames
-            if frame_idx % FRAME_SAMPLE_RATE != 0:
-                frame_idx += 1
-                continue
+                for (frame_idx, slot, frame, _), detections in zip(batch, batch_detections):
+                    # Analyze crowd (plain int timestamp; consumers format it if needed)
+                    timestamp_ns = time.time_ns()
+                    metrics = analyzer.analyze(detections, timestamp_ns, time_delta)
+                    
+                    # Create visualization
+                    annotated = self.detector.draw_detections(frame, detections, inplace=True)
+                    
+                    # Add heatmap
+                    if len(detections) > 0:
+                        heatmap = analyzer.create_density_heatmap(detections.centers)
+                        annotated = analyzer.apply_heatmap_overlay(annotated, heatmap, 0.3, inplace=True)
+                        
+                    # Draw high-density zones
+                    self._draw_density_zones(annotated, metrics.high_density_zones)
+                        
+                    # Add metrics overlay
+                    self._draw_metrics_overlay(annotated, metrics)
+                    
+                    # Save frame
+                    if writer_thread:
+                        ring.retain(slot)
+                        write_q.put((frame_idx, slot, annotated))
+                        
+                    # Show preview
+                    if show_preview:
+                        cv2.imshow('CrowdGuard AI', annotated)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            return
+                            
+                    processed_frames += 1
+                    
+                    # Yield results
+                    yield {
+                        "frame_idx": frame_idx,
+                        "timestamp_ns": timestamp_ns,
+                        "detections": detections,
+                        "metrics": metrics,
+                        "annotated_frame": annotated
+                    }
+                    
+                    # The consumer is done with this frame's buffer
+                    ring.release(slot)
+        finally:
+            # Cleanup (also runs when the consumer stops iterating early)
+            stop_event.set()
+            ring.unblock()
+            while reader_thread.is_alive():
+                try:
+                    item = read_q.get_nowait()
+                    if item is not None:
+                        ring.release(item[1])
+                except queue.Empty:
+                    reader_thread.join(timeout=0.01)
+            cap.release()
+            
+            if writer_thread:
+                write_q.put(None)
+                writer_thread.join()
+                writer.release()
+            PIPELINE_CORES.release(cores)
+            if show_preview:
+                cv2.destroyAllWindows()
                 
-            # Detect people
-            detections = self.detector.detect_people(frame)
+            elapsed = time.time() - start_time
+            if elapsed > 0:
+                print(f"✅ Processed {processed_frames} frames in {elapsed:.2f}s ({processed_frames/elapsed:.1f} fps)")
             
-            # Analyze crowd
-            timestamp = datetime.now().isoformat()
-            time_delta = 1.0 / fps * FRAME_SAMPLE_RATE
-            metrics = self.analyzer.analyze(detections, timestamp, time_delta)
+    @classmethod
+    def probe_file(cls, video_path: str) -> Optional[CaptureInfo]:
+        """
+        Check that a video file opens and decodes before it is processed.
+        
+        Args:
+            video_path: Path to the video file
             
-            # Create visualization
-            annotated = self.detector.draw_detections(frame, detections)
+        Returns:
+            CaptureInfo, or None if the file can't be opened or its first frame can't be decoded
+        """
+        cap = cv2.VideoCapture(video_path)
+        try:
+            if not cap.isOpened() or not cap.grab():
+                return None
+            return cls._probe(cap)
+        finally:
+            cap.release()
             
-            # Add heatmap
-            if len(detections) > 0:
-                centers = np.array([det["center"] for det in detections])
-                heatmap = self.analyzer.create_density_heatmap(centers)
-                annotated = self.analyzer.apply_heatmap_overlay(annotated, heatmap, 0.3)
-                
-            # Draw high-density zones
-            for zone in metrics.high_density_zones:
-                x1, y1, x2, y2 = zone["bbox"]
-                color = (0, 0, 255) if zone["density_level"] == "critical" else (0, 165, 255)
-                cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 3)
-                cv2.putText(
-                    annotated,
-                    f"HIGH DENSITY: {zone['person_count']}",
-                    (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    color,
-                    2
-                )
-                
-            # Add metrics overlay
-            self._draw_metrics_overlay(annotated, metrics)
+    @staticmethod
+    def _probe(cap: cv2.VideoCapture) -> CaptureInfo:
+        """Read the capture's frame rate, size and length in one place."""
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        return CaptureInfo(
+            fps=fps if fps > 0 else DEFAULT_FPS,
+            width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            frame_count=max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        )
+        
+    @staticmethod
+    def _open_writer(output_path: str, fps: float, size: Tuple[int, int]) -> cv2.VideoWriter:
+        """Open an H.264 writer (hardware-accelerated when available), falling back to mp4v."""
+        writer = cv2.VideoWriter(
+            output_path,
+            cv2.CAP_FFMPEG,
+            cv2.VideoWriter_fourcc(*'avc1'),
+            fps,
+            size,
+            [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        )
+        if writer.isOpened():
+            return writer
             
-            # Save frame
-            if writer:
-                writer.write(annotated)
-                
-            # Show preview
-            if show_preview:
-                cv2.imshow('CrowdGuard AI', annotated)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+        print("⚠️ H.264 encoder unavailable, falling back to mp4v")
+        writer.release()
+        return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        
+    @staticmethod
+    def _read_frames(
+        cap: cv2.VideoCapture,
+        ring: _FrameRing,
+        read_q: queue.Queue,
+        stop_event: threading.Event,
+        det_size: Optional[Tuple[int, int]] = None,
+        core: Optional[int] = None
+    ) -> None:
+        """
+        Decode sampled frames into read_q, ending with a None sentinel.
+        
+        Items are (frame_idx, slot, frame, det_frame): frame is decoded into
+        ring slot, and det_frame is it resized to det_size (width, height)
+        for detection, or frame itself.
+        The thread pins itself to core when one is given.
+        """
+        _pin_current_thread(core)
+        frame_idx = 0
+        try:
+            while not stop_event.is_set():
+                if not cap.grab():
                     break
                     
-            # Yield results
-            yield {
-                "frame_idx": frame_idx,
-                "timestamp": timestamp,
-                "detections": detections,
-                "metrics": metrics,
-                "annotated_frame": annotated
-            }
-            
-            frame_idx += 1
-            
-        # Cleanup
-        cap.release()
-        if writer:
-            writer.release()
-        if show_preview:
-            cv2.destroyAllWindows()
+                # Sample frames; skipped frames are never converted to BGR
+                if frame_idx % FRAME_SAMPLE_RATE == 0:
+                    slot = ring.acquire()
+                    if slot is None or stop_event.is_set():
+                        break
+                    ret, frame = cap.retrieve(ring.buffers[slot])
+                    if not ret:
+                        break
+                    det_frame = frame
+                    if det_size:
+                        det_frame = cv2.resize(frame, det_size, interpolation=cv2.INTER_LINEAR)
+                    read_q.put((frame_idx, slot, frame, det_frame))
+                frame_idx += 1
+        finally:
+            read_q.put(None)
             
-        elapsed = time.time() - start_time
-        processed_frames = frame_idx // FRAME_SAMPLE_RATE
-        print(f"✅ Processed {processed_frames} frames in {elapsed:.2f}s ({processed_frames/elapsed:.1f} fps)")
+    @staticmethod
+    def _write_frames(
+        writer: cv2.VideoWriter,
+        ring: _FrameRing,
+        write_q: queue.Queue,
+        core: Optional[int] = None
+    ) -> None:
+        """
+        Encode (frame_idx, slot, frame) items from write_q until a None sentinel arrives.
         
+        Each ring slot is released once written. The thread pins itself to
+        core when one is given.
+        """
+        _pin_current_thread(core)
+        failed = False
+        while True:
+            item = write_q.get()
+            if item is None:
+                break
+            frame_idx, slot, frame = item
+            try:
+                # After a failure keep draining so the processing stage never blocks
+                if not failed:
+                    writer.write(frame)
+            except cv2.error as e:
+                print(f"❌ Error writing frame {frame_idx}: {e}")
+                failed = True
+            finally:
+                ring.release(slot)
+            
     def process_rtsp_stream(
         self,
         rtsp_url: str,
@@ -159,49 +460,50 @@ class VideoProcessor:
             raise ValueError(f"Cannot connect to RTSP stream: {rtsp_url}")
             
         # Get stream properties
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        info = self._probe(cap)
         
-        print(f"📡 Connected to RTSP stream: {width}x{height}")
+        print(f"📡 Connected to RTSP stream: {info.width}x{info.height}")
         
         # Initialize analyzer
-        self.analyzer = CrowdAnalyzer((height, width))
+        self.analyzer = CrowdAnalyzer((info.height, info.width))
         
         frame_idx = 0
-        last_process_time = time.time()
+        last_process_ns = time.time_ns()
         
         try:
             while True:
-                ret, frame = cap.read()
+                ret = cap.grab()
+                
+                # Sample frames; skipped frames are never converted to BGR
+                if ret and frame_idx % FRAME_SAMPLE_RATE != 0:
+                    frame_idx += 1
+                    continue
+                    
+                if ret:
+                    ret, frame = cap.retrieve()
                 if not ret:
                     print("⚠️ Lost connection to stream, reconnecting...")
                     time.sleep(5)
                     cap = cv2.VideoCapture(rtsp_url)
                     continue
                     
-                # Sample frames
-                if frame_idx % FRAME_SAMPLE_RATE != 0:
-                    frame_idx += 1
-                    continue
-                    
                 # Process frame
-                current_time = time.time()
-                time_delta = current_time - last_process_time
+                timestamp_ns = time.time_ns()
+                time_delta = (timestamp_ns - last_process_ns) / 1e9
                 
                 detections = self.detector.detect_people(frame)
-                timestamp = datetime.now().isoformat()
-                metrics = self.analyzer.analyze(detections, timestamp, time_delta)
+                metrics = self.analyzer.analyze(detections, timestamp_ns, time_delta)
                 
                 # Callback
                 if callback:
                     callback({
-                        "timestamp": timestamp,
+                        "timestamp_ns": timestamp_ns,
                         "detections": detections,
                         "metrics": metrics,
                         "frame": frame
                     })
                     
-                last_process_time = current_time
+                last_process_ns = timestamp_ns
                 frame_idx += 1
                 
         except KeyboardInterrupt:
@@ -209,36 +511,90 @@ class VideoProcessor:
         finally:
             cap.release()
             
+    def _draw_density_zones(self, frame: np.ndarray, zones) -> None:
+        """Draw high-density zone boxes and labels on frame, specialized by zone count."""
+        # Most frames have no zones or a single one; only larger sets are worth
+        # building arrays for
+        if not zones:
+            return
+        if len(zones) == 1:
+            self._draw_density_zone(frame, zones[0])
+            return
+            
+        bboxes = np.array([zone["bbox"] for zone in zones], dtype=np.int32)
+        critical = np.array([zone["density_level"] == "critical" for zone in zones])
+        
+        # All boxes of one level in a single polylines call
+        corners = bboxes[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+        for mask, color in ((critical, (0, 0, 255)), (~critical, (0, 165, 255))):
+            if mask.any():
+                cv2.polylines(frame, list(corners[mask]), True, color, 3)
+                
+        anchors = bboxes[:, :2] - (0, 10)
+        for zone, (x, y), is_critical in zip(zones, anchors.tolist(), critical.tolist()):
+            cv2.putText(
+                frame,
+                f"HIGH DENSITY: {zone['person_count']}",
+                (x, y),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (0, 0, 255) if is_critical else (0, 165, 255),
+                2
+            )
+            
+    @staticmethod
+    def _draw_density_zone(frame: np.ndarray, zone: Dict) -> None:
+        """Draw one high-density zone box and label on frame."""
+        x1, y1, x2, y2 = zone["bbox"]
+        color = (0, 0, 255) if zone["density_level"] == "critical" else (0, 165, 255)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+        cv2.putText(
+            frame,
+            f"HIGH DENSITY: {zone['person_count']}",
+            (x1, y1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.6,
+            color,
+            2
+        )
+        
     def _draw_metrics_overlay(self, frame: np.ndarray, metrics) -> None:
         """Draw metrics overlay on frame."""
-        # Background panel
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (10, 50), (400, 250), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.6, frame, 0.4, 0, frame)
+        # Background panel: blending black at 0.6 only scales the panel region
+        # by 0.4, so darken that ROI in place instead of copying the whole frame
+        panel = frame[50:251, 10:401]
+        if not panel.size:
+            # Frame too small for the panel; the text would land off-frame too
+            return
+        cv2.convertScaleAbs(panel, panel, 0.4)
         
-        # Metrics text
+        # Metrics text, reformatted only when the values change (key and text swapped together)
         y_offset = 80
         line_height = 30
         
-        metrics_text = [
-            f"People Count: {metrics.total_count}",
-            f"Density Score: {metrics.density_score:.1f}/100",
-            f"Risk Level: {metrics.risk_level.value}",
-            f"Risk Score: {metrics.risk_score:.1f}/100",
-            f"Anomaly: {metrics.anomaly_type.value}",
-            f"Velocity: {metrics.avg_velocity:.1f} px/s"
-        ]
+        key = (
+            metrics.total_count,
+            metrics.density_score,
+            metrics.risk_level,
+            metrics.risk_score,
+            metrics.anomaly_type,
+            metrics.avg_velocity
+        )
+        text_cache = self._metrics_text_cache
+        if text_cache is None or text_cache[0] != key:
+            text_cache = self._metrics_text_cache = (key, (
+                f"People Count: {metrics.total_count}",
+                f"Density Score: {metrics.density_score:.1f}/100",
+                f"Risk Level: {metrics.risk_level.value}",
+                f"Risk Score: {metrics.risk_score:.1f}/100",
+                f"Anomaly: {metrics.anomaly_type.value}",
+                f"Velocity: {metrics.avg_velocity:.1f} px/s"
+            ))
+        metrics_text = text_cache[1]
         
         # Color based on risk
-        if metrics.risk_level.value == "CRITICAL":
-            color = (0, 0, 255)
-        elif metrics.risk_level.value == "HIGH":
-            color = (0, 165, 255)
-        elif metrics.risk_level.value == "MEDIUM":
-            color = (0, 255, 255)
-        else:
-            color = (0, 255, 0)
-            
+        color = self._RISK_COLORS[metrics.risk_level.value]
+        
         for text in metrics_text:
             cv2.putText(
                 frame,